@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.contrib.auth.context_processors import PermWrapper
+from django.core.cache import cache
+from .models import Exhibition, Staff, User, new_actor_version
+
+
+def actor_cache_key(user):
+    return 'actor_%d_%d' % (user.id, user.actor_version)
+
+
+def invalidate_actor(*user_ids):
+    # The version lives on the user row every request loads anyway, so an entry left in the cache of another
+    # process is never read again.
+    User.objects.filter(id__in=user_ids).update(actor_version=new_actor_version())
+
+
+class Actor:
+    # The user of a request with the staff row, exhibition and permissions the views and templates check.
+
+    def __init__(self, user, staff=None, permissions=frozenset()):
+        self.user = user
+        self.staff = staff
+        self.exhibition = staff.exhibition if staff else None
+        self.permissions = permissions
+
+    @property
+    def is_staff(self):
+        return self.staff is not None
+
+    @property
+    def perms(self):
+        return PermWrapper(self.user)
+
+    def has_perm(self, perm):
+        return self.user.is_active and perm in self.permissions
+
+
+def load_actor_data(user):
+    staff = Staff.objects.filter(user=user).values('id', 'exhibition_id', 'is_senior').first()
+    return {'staff': staff, 'permissions': sorted(user.get_all_permissions())}
+
+
+def get_actor(user):
+    # The staff row and permissions are cached across requests under the actor_version the signals replace.
+    # The exhibition only carries its id, its other fields are loaded when a view reads them.
+    if not user.is_authenticated:
+        return Actor(user)
+    key = actor_cache_key(user)
+    data = cache.get(key)
+    if data is None:
+        data = load_actor_data(user)
+        cache.set(key, data, getattr(settings, 'ACTOR_CACHE_TIMEOUT', 300))
+    staff = None
+    if data['staff']:
+        values = dict(data['staff'], user_id=user.id)
+        staff = Staff.from_db(user._state.db, list(values),
+                              [values[field.attname] for field in Staff._meta.concrete_fields])
+        staff.exhibition = Exhibition.from_db(user._state.db, ['id'], [data['staff']['exhibition_id']])
+        staff.user = user
+    User.staff.related.set_cached_value(user, staff)
+    permissions = frozenset(data['permissions'])
+    # ModelBackend reads this cache, so has_perm, PermissionRequiredMixin and {{ perms }} run no queries.
+    user._perm_cache = set(permissions)
+    return Actor(user, staff, permissions)
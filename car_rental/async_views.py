@@ -0,0 +1,174 @@
+import asyncio
+import io
+import json
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.contrib.auth.views import redirect_to_login
+from django.core import signals
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import get_object_or_404, render
+from django.urls import get_script_prefix, reverse
+from django.utils import timezone
+
+from . import views
+from .actors import get_actor
+from .catalog import aget_cached_catalog, get_catalog
+from .events import exhibition_channel, get_broker, user_channel
+from .models import Car
+
+
+def load_user(request):
+    request.actor = get_actor(get_user(request))
+    return request.actor.user
+
+
+async def aload_user(request):
+    # Session, user, permissions and staff row are loaded by ActorMiddleware or else in one thread hop, so
+    # templates and permission checks that follow only read cached values and never touch the database
+    # from the event loop.
+    if not hasattr(request, 'actor'):
+        await sync_to_async(load_user)(request)
+    request.user = request.actor.user
+    return request.user
+
+
+async def home_view(request):
+    await aload_user(request)
+    return render(request, 'car_rental/home.html')
+
+
+def load_catalog(view, filterset):
+    if filterset.is_valid():
+        return get_catalog(view.request.GET, filterset.qs)
+    return []
+
+
+async def car_list_renter_view(request):
+    user = await aload_user(request)
+    if user.is_staff:
+        raise PermissionDenied
+    view = views.CarListRenterView()
+    view.setup(request)
+    filterset = view.get_filterset(view.get_filterset_class())
+    cars = await aget_cached_catalog(request.GET) if filterset.is_valid() else None
+    if cars is None:
+        cars = await sync_to_async(load_catalog)(view, filterset)
+    return render(request, view.template_name, {'view': view, 'filter': filterset, 'object_list': cars, 'cars': cars})
+
+
+async def car_detail_view(request, pk):
+    await aload_user(request)
+    car = await sync_to_async(get_object_or_404)(Car.objects.select_related('owner', 'renter'), pk=pk)
+    is_owner = request.actor.is_staff and request.actor.exhibition.id == car.owner_id
+    is_editable = is_owner and await sync_to_async(car.is_without_bookings_after)(timezone.now())
+    return render(request, 'car_rental/car_detail.html', {'car': car, 'object': car, 'is_owner': is_owner,
+                                                          'is_rented': car.is_rented(), 'is_editable': is_editable})
+
+
+def load_rent_requests(view):
+    # The same steps as FilterView.get. Rows, the bounded count and the table all come out of here, so
+    # rendering on the event loop afterwards only reads values that are already loaded.
+    filterset = view.get_filterset(view.get_filterset_class())
+    if not filterset.is_bound or filterset.is_valid() or not view.get_strict():
+        view.object_list = filterset.qs
+    else:
+        view.object_list = filterset.queryset.none()
+    return view.get_context_data(filter=filterset, object_list=view.object_list)
+
+
+async def rent_request_renter_list_view(request):
+    user = await aload_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    if user.is_staff:
+        raise PermissionDenied
+    view = views.RentRequestRenterListView()
+    view.setup(request)
+    context = await sync_to_async(load_rent_requests)(view)
+    return render(request, view.template_name, context)
+
+
+def get_event_channels(actor):
+    if not actor.user.is_authenticated:
+        return []
+    channels = [user_channel(actor.user.id)]
+    if actor.is_staff and actor.has_perm('car_rental.can_answer_request'):
+        channels.append(exhibition_channel(actor.exhibition.id))
+    return channels
+
+
+def load_event_channels(request):
+    # The stream stays open for as long as the page does, so its database connection is given back the way
+    # the end of a normal request gives it back.
+    signals.request_started.send(sender=ASGIRequest)
+    try:
+        engine = import_module(settings.SESSION_ENGINE)
+        request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+        load_user(request)
+        return get_event_channels(request.actor)
+    finally:
+        signals.request_finished.send(sender=ASGIRequest)
+
+
+def format_event(event):
+    return ('event: %s\ndata: %s\n\n' % (event['event'], json.dumps(event['data']))).encode()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def event_stream(scope, receive, send):
+    # Server-sent events of the requests of the user and, for staff who answer requests, of the exhibition.
+    # Django 4.0 cannot stream from a coroutine, so car_site/asgi.py routes the events URL here directly.
+    request = ASGIRequest(scope, io.BytesIO())
+    channels = await sync_to_async(load_event_channels)(request)
+    if not channels:
+        await send({'type': 'http.response.start', 'status': 403, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Forbidden'})
+        return
+    subscription = get_broker().subscribe(channels)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    getter = None
+    keepalive = getattr(settings, 'EVENT_STREAM_KEEPALIVE', 15)
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]})
+        await send({'type': 'http.response.body', 'body': b'retry: %d\n\n' % (keepalive * 1000),
+                    'more_body': True})
+        while True:
+            getter = getter or asyncio.ensure_future(subscription.get())
+            done, pending = await asyncio.wait((getter, disconnected), timeout=keepalive,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                break
+            if getter in done:
+                body = format_event(getter.result())
+                getter = None
+            else:
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        subscription.close()
+        for task in (getter, disconnected):
+            if task:
+                task.cancel()
+
+
+def route_events(application):
+    events_path = None
+
+    async def router(scope, receive, send):
+        nonlocal events_path
+        if events_path is None:
+            events_path = reverse('car_rental:events')[len(get_script_prefix()) - 1:]
+        if scope['type'] == 'http' and scope['path'][len(scope.get('root_path', '')):] == events_path:
+            return await event_stream(scope, receive, send)
+        return await application(scope, receive, send)
+
+    return router
@@ -0,0 +1,83 @@
+import hashlib
+from math import ceil
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+# The epoch and the cached catalogs live in the default cache. With the LocMem backend every process keeps
+# its own epoch, so a worker that did not make a change serves its catalog until the entry times out.
+EPOCH_KEY = 'car_availability_epoch'
+
+
+def get_availability_epoch():
+    epoch = cache.get(EPOCH_KEY)
+    if epoch is None:
+        cache.add(EPOCH_KEY, 1, None)
+        epoch = cache.get(EPOCH_KEY, 1)
+    return epoch
+
+
+def _advance():
+    try:
+        cache.incr(EPOCH_KEY)
+    except ValueError:
+        cache.add(EPOCH_KEY, 1, None)
+
+
+def advance_availability_epoch():
+    # Advance now so this transaction sees fresh results and again on commit, so a catalog cached by
+    # another request before the commit is not served afterwards.
+    _advance()
+    transaction.on_commit(_advance)
+
+
+def get_next_change_querysets(now):
+    # Each one reads a single row from an index that leads with its time column.
+    from .models import Car, RentRequest
+
+    for queryset in (Car.objects.filter(renter__isnull=False), RentRequest.objects.accepted()):
+        yield queryset.filter(rent_start_time__gt=now).order_by('rent_start_time') \
+            .values_list('rent_start_time', flat=True)[:1]
+        yield queryset.filter(rent_end_time__gt=now).order_by('rent_end_time') \
+            .values_list('rent_end_time', flat=True)[:1]
+
+
+def get_next_change(now):
+    times = [time for queryset in get_next_change_querysets(now) for time in queryset]
+    return min(times) if times else None
+
+
+def get_catalog_timeout(now):
+    timeout = getattr(settings, 'CAR_CATALOG_CACHE_TIMEOUT', 60)
+    next_change = get_next_change(now)
+    if next_change is not None:
+        timeout = min(timeout, max(1, ceil((next_change - now).total_seconds())))
+    return timeout
+
+
+def get_catalog_key(params, epoch):
+    query = '&'.join('%s=%s' % (name, value) for name, values in sorted(params.lists()) for value in values if value)
+    return 'car_catalog_%s_%s' % (epoch, hashlib.md5(query.encode()).hexdigest())
+
+
+def get_catalog(params, queryset):
+    if not getattr(settings, 'CAR_CATALOG_CACHE_TIMEOUT', 60):
+        return list(queryset)
+    key = get_catalog_key(params, get_availability_epoch())
+    cars = cache.get(key)
+    if cars is None:
+        now = timezone.now()
+        cars = list(queryset)
+        cache.set(key, cars, get_catalog_timeout(now))
+    return cars
+
+
+async def aget_cached_catalog(params):
+    if not getattr(settings, 'CAR_CATALOG_CACHE_TIMEOUT', 60):
+        return None
+    epoch = await cache.aget(EPOCH_KEY)
+    if epoch is None:
+        return None
+    return await cache.aget(get_catalog_key(params, epoch))
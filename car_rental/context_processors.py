@@ -0,0 +1,5 @@
+def actor(request):
+    actor = getattr(request, 'actor', None)
+    if actor is None:
+        return {}
+    return {'actor': actor, 'perms': actor.perms}
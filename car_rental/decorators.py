@@ -27,3 +27,16 @@ def user_is_not_staff(function):
     wrap.__doc__ = function.__doc__
     wrap.__name__ = function.__name__
     return wrap
+
+
+def user_is_senior_staff(function):
+    def wrap(request, *args, **kwargs):
+        user = request.user
+        if user.is_staff and user.staff.is_senior:
+            return function(request, *args, **kwargs)
+        else:
+            raise PermissionDenied
+
+    wrap.__doc__ = function.__doc__
+    wrap.__name__ = function.__name__
+    return wrap
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def user_channel(user_id):
+    return 'user:%d' % user_id
+
+
+def exhibition_channel(exhibition_id):
+    return 'exhibition:%d' % exhibition_id
+
+
+class LocalTransport:
+    # Delivers events to the streams of this process only. A cross-worker transport, for example on Redis
+    # pub/sub, implements the same send and close methods and calls deliver for the events of every worker.
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def send(self, channel, event):
+        self.deliver(channel, event)
+
+    def close(self):
+        pass
+
+
+class Subscription:
+
+    def __init__(self, broker, channels, queue_size):
+        self.broker = broker
+        self.channels = tuple(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+
+    def put(self, event):
+        # A client too slow to read its stream loses events instead of growing the queue.
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+
+    def __init__(self, transport_class=LocalTransport, queue_size=100):
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+        self.queue_size = queue_size
+        self.transport = transport_class(self.deliver)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels, self.queue_size)
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscriptions = self.subscriptions.get(channel)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del self.subscriptions[channel]
+
+    def publish(self, channel, kind, data):
+        self.transport.send(channel, {'event': kind, 'data': data})
+
+    def deliver(self, channel, event):
+        # Called from any thread, so the event is handed to the event loop every stream runs on.
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+    def close(self):
+        self.transport.close()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            transport_class = import_string(getattr(settings, 'EVENT_TRANSPORT', 'car_rental.events.LocalTransport'))
+            _broker = Broker(transport_class, getattr(settings, 'EVENT_QUEUE_SIZE', 100))
+        return _broker
+
+
+def publish(channel, kind, data):
+    # Streams only hear about changes that were committed.
+    transaction.on_commit(lambda: get_broker().publish(channel, kind, data))
@@ -1,19 +1,53 @@
 import django_filters
 from bootstrap_datepicker_plus.widgets import DateTimePickerInput
+from django.utils import timezone
 
 from car_rental.models import Car, RentRequest
+from car_rental.search import search_cars
 
 
 class CarFilterSet(django_filters.FilterSet):
-    car_type = django_filters.CharFilter(label='Model', lookup_expr='icontains')
+    car_type = django_filters.CharFilter(label='Search', method='search')
     popular = django_filters.ChoiceFilter(label='', method='popular_cars', choices=[('P', 'popular'), ])
+    ordering = django_filters.OrderingFilter(label='Sort by', fields=(('request_count', 'popularity'),),
+                                             field_labels={'request_count': 'popularity'})
+
+    def search(self, queryset, name, value):
+        return search_cars(queryset, value)
 
     def popular_cars(self, queryset, name, value):
-        queryset2 = Car.objects.none()
-        for car in queryset:
-            if car.rentrequest_set.count() >= 3:
-                queryset2 |= Car.objects.filter(pk=car.pk)
-        return queryset2
+        return queryset.popular()
+
+    class Meta:
+        model = Car
+        fields = ['car_type']
+
+
+class CarStaffFilterSet(CarFilterSet):
+    status = django_filters.ChoiceFilter(label='Availability', choices=Car.STATUS_CHOICES)
+    ordering = django_filters.OrderingFilter(label='Sort by', fields=(('request_count', 'popularity'),
+                                                                      ('status', 'status')),
+                                             field_labels={'request_count': 'popularity', 'status': 'availability'})
+
+    class Meta:
+        model = Car
+        fields = ['car_type', 'status']
+
+
+class CarRenterFilterSet(CarFilterSet):
+    available_from = django_filters.DateTimeFilter(label='From', method='filter_window',
+                                                   widget=DateTimePickerInput())
+    available_until = django_filters.DateTimeFilter(label='Until', method='filter_window',
+                                                    widget=DateTimePickerInput())
+
+    def filter_window(self, queryset, name, value):
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super(CarRenterFilterSet, self).filter_queryset(queryset)
+        start_time = self.form.cleaned_data.get('available_from') or timezone.now()
+        end_time = self.form.cleaned_data.get('available_until') or start_time
+        return queryset.free_between(start_time, max(start_time, end_time))
 
     class Meta:
         model = Car
@@ -1,3 +1,5 @@
+import codecs
+
 from django import forms
 from django.contrib.auth import authenticate
 from django.contrib.auth.forms import UserCreationForm
@@ -50,6 +52,67 @@ class StaffCreationForm(UserCreationForm):
         fields = ('username', 'staff_type', 'password1', 'password2',)
 
 
+def check_utf8(uploaded_file):
+    # Checked before the import starts, so a file in another encoding saves no rows.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for chunk in uploaded_file.chunks():
+            decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        raise ValidationError('The file should be UTF-8 encoded text.')
+    uploaded_file.seek(0)
+    return uploaded_file
+
+
+class StaffImportForm(forms.Form):
+    file = forms.FileField(label='CSV file', help_text='Columns: username, password, type (N or S)')
+
+    def clean_file(self):
+        return check_utf8(self.cleaned_data['file'])
+
+
+class CarImportForm(forms.Form):
+    file = forms.FileField(label='CSV or JSONL file',
+                           help_text='Columns: car_type, plate, price_per_hour and an optional image file name')
+    images = forms.FileField(label='Images', required=False, help_text='A ZIP archive of the images')
+
+    def clean_file(self):
+        return check_utf8(self.cleaned_data['file'])
+
+
+class CarBulkActionForm(forms.Form):
+    ACTIONS = (
+        ('reprice_percent', 'Change price by percent'),
+        ('reprice_amount', 'Set price'),
+        ('mark_repair', 'Mark as needing repair'),
+        ('clear_repair', 'Clear repair'),
+        ('delete', 'Delete'),
+    )
+    action = forms.ChoiceField(choices=ACTIONS)
+    value = forms.IntegerField(required=False)
+    selection = forms.Field(required=False, widget=forms.MultipleHiddenInput)
+    select_all = forms.BooleanField(required=False, label='All cars matching the search')
+
+    def clean_selection(self):
+        try:
+            return [int(car_id) for car_id in self.cleaned_data['selection'] or []]
+        except (TypeError, ValueError):
+            raise forms.ValidationError('Invalid selection.')
+
+    def clean(self):
+        cleaned_data = super(CarBulkActionForm, self).clean()
+        action = cleaned_data.get('action')
+        value = cleaned_data.get('value')
+        if not cleaned_data.get('select_all') and not cleaned_data.get('selection'):
+            raise forms.ValidationError('Select at least one car.')
+        if action == 'reprice_percent' and (value is None or value <= -100):
+            self.add_error('value', 'Enter a percent greater than -100.')
+        if action == 'reprice_amount' and (value is None or value < 1):
+            self.add_error('value', 'Enter a price of at least 1.')
+        return cleaned_data
+
+
 class RentRequestForm(forms.Form):
     rent_start_time = forms.DateTimeField()
     rent_end_time = forms.DateTimeField()
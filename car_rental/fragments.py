@@ -0,0 +1,18 @@
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+
+FRAGMENT_CACHE = 'fragments'
+
+
+def get_car_fragment_keys(car_id, updated_at):
+    return [
+        make_template_fragment_key('car_card', [car_id, updated_at]),
+        make_template_fragment_key('car_detail_header', [car_id, updated_at]),
+        make_template_fragment_key('car_detail_info', [car_id, updated_at, True]),
+        make_template_fragment_key('car_detail_info', [car_id, updated_at, False]),
+    ]
+
+
+def delete_car_fragments(car_id, updated_at):
+    if updated_at is not None:
+        caches[FRAGMENT_CACHE].delete_many(get_car_fragment_keys(car_id, updated_at))
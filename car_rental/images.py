@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .catalog import advance_availability_epoch
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_widths():
+    return getattr(settings, 'CAR_IMAGE_WIDTHS', (320, 640, 1024))
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'CAR_IMAGE_WORKERS', 2),
+                                           thread_name_prefix='car-images')
+        return _executor
+
+
+def derivative_name(name, digest, width):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return 'cars/derivatives/%s-%s-%s.webp' % (stem, digest[:12], width)
+
+
+def generate_derivatives(name, storage=default_storage):
+    with storage.open(name, 'rb') as source:
+        content = source.read()
+    digest = hashlib.sha256(content).hexdigest()
+    image = ImageOps.exif_transpose(Image.open(BytesIO(content)))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    derivatives = {}
+    for width in sorted(get_widths()):
+        if derivatives and width > image.width:
+            break
+        target = derivative_name(name, digest, width)
+        if not storage.exists(target):
+            size = (min(width, image.width), max(1, round(image.height * min(width, image.width) / image.width)))
+            resized = image.resize(size, Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(buffer, 'WEBP', quality=getattr(settings, 'CAR_IMAGE_QUALITY', 80), method=4)
+            storage.save(target, ContentFile(buffer.getvalue()))
+        derivatives[str(min(width, image.width))] = target
+    return derivatives
+
+
+def build_car_derivatives(car_id):
+    from .models import Car
+
+    name = Car.objects.filter(id=car_id).values_list('image', flat=True).first()
+    if not name:
+        return {}
+    derivatives = generate_derivatives(name)
+    if Car.objects.filter(id=car_id, image=name).update(image_derivatives=derivatives, updated_at=timezone.now()):
+        advance_availability_epoch()
+    return derivatives
+
+
+def _build_in_worker(car_id):
+    try:
+        build_car_derivatives(car_id)
+    except Exception:
+        logger.exception('Could not build image derivatives for car %s', car_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_derivatives(car):
+    if not car.image:
+        return
+    if getattr(settings, 'CAR_IMAGE_DERIVATIVES_ASYNC', True):
+        transaction.on_commit(lambda: get_executor().submit(_build_in_worker, car.id))
+    else:
+        transaction.on_commit(lambda: build_car_derivatives(car.id))
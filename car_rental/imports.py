@@ -0,0 +1,247 @@
+import csv
+import io
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Permission
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils._os import safe_join
+from PIL import Image
+
+from car_rental.catalog import advance_availability_epoch
+from car_rental.images import schedule_derivatives
+from car_rental.models import Car, User, Staff
+from car_rental.search import index_cars
+from car_rental.transactions import immediate_atomic, write_transaction
+
+CAR_FIELDS = ('car_type', 'plate', 'price_per_hour')
+
+
+def hash_passwords(passwords, workers=None):
+    workers = workers or getattr(settings, 'STAFF_IMPORT_WORKERS', None) or os.cpu_count() or 1
+    if workers <= 1 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def clean_staff_row(row):
+    username = (row.get('username') or '').strip()
+    password = row.get('password') or ''
+    staff_type = (row.get('type') or 'N').strip().upper()
+    if staff_type not in ('N', 'S', 'NORMAL', 'SENIOR'):
+        raise ValidationError('Type should be N or S.')
+    user = User(username=username)
+    user.clean_fields(exclude=['password'])
+    validate_password(password, user)
+    return username, password, staff_type in ('S', 'SENIOR')
+
+
+@write_transaction
+def create_staff(exhibition, staff_rows, hashes):
+    User.objects.bulk_create([User(username=username, password=password_hash, is_staff=True)
+                              for (line, username, password, is_senior), password_hash in zip(staff_rows, hashes)])
+    users = User.objects.filter(username__in=[staff_row[1] for staff_row in staff_rows]).in_bulk(
+        field_name='username')
+    Staff.objects.bulk_create([Staff(user=users[username], exhibition=exhibition, is_senior=is_senior)
+                               for line, username, password, is_senior in staff_rows])
+    permissions = list(Permission.objects.filter(codename__in=Staff.SENIOR_PERMISSIONS))
+    UserPermission = User.user_permissions.through
+    UserPermission.objects.bulk_create([UserPermission(user_id=users[username].id, permission_id=permission.id)
+                                        for line, username, password, is_senior in staff_rows if is_senior
+                                        for permission in permissions])
+
+
+def import_staff(exhibition, rows, workers=None):
+    errors = []
+    staff_rows = []
+    usernames = set()
+    for line, row in enumerate(rows, start=2):
+        try:
+            username, password, is_senior = clean_staff_row(row)
+        except ValidationError as error:
+            errors.append((line, ' '.join(error.messages)))
+            continue
+        if username in usernames:
+            errors.append((line, 'Username %s is repeated in the file.' % username))
+            continue
+        usernames.add(username)
+        staff_rows.append((line, username, password, is_senior))
+
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    errors += [(line, 'A user with username %s already exists.' % username)
+               for line, username, password, is_senior in staff_rows if username in existing]
+    staff_rows = [staff_row for staff_row in staff_rows if staff_row[1] not in existing]
+    if not staff_rows:
+        return 0, sorted(errors)
+
+    hashes = hash_passwords([password for line, username, password, is_senior in staff_rows], workers)
+    create_staff(exhibition, staff_rows, hashes)
+    return len(staff_rows), sorted(errors)
+
+
+def get_max_image_size():
+    return getattr(settings, 'CAR_IMPORT_MAX_IMAGE_SIZE', 10 * 1024 * 1024)
+
+
+class ErrorReport:
+
+    def __init__(self, writer=None, limit=100):
+        self.writer = writer
+        self.limit = limit
+        self.count = 0
+        self.errors = []
+
+    def add(self, line, error):
+        self.count += 1
+        if len(self.errors) < self.limit:
+            self.errors.append((line, error))
+        if self.writer is not None:
+            self.writer.writerow([line, error])
+
+
+class DirectoryImages:
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, name):
+        try:
+            path = safe_join(self.path, name)
+        except ValueError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        if os.path.getsize(path) > get_max_image_size():
+            raise ValidationError('Image %s is too large.' % name)
+        with open(path, 'rb') as image_file:
+            return image_file.read()
+
+    def close(self):
+        pass
+
+
+class ArchiveImages:
+
+    def __init__(self, archive):
+        self.archive = zipfile.ZipFile(archive)
+        self.names = set(self.archive.namelist())
+
+    def read(self, name):
+        if name not in self.names:
+            return None
+        if self.archive.getinfo(name).file_size > get_max_image_size():
+            raise ValidationError('Image %s is too large.' % name)
+        return self.archive.read(name)
+
+    def close(self):
+        self.archive.close()
+
+
+def open_images(path):
+    if os.path.isdir(path):
+        return DirectoryImages(path)
+    return ArchiveImages(path)
+
+
+def read_car_rows(car_file, file_format='csv'):
+    if file_format == 'jsonl':
+        for line, text in enumerate(car_file, start=1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except ValueError:
+                yield line, None
+    else:
+        yield from enumerate(csv.DictReader(car_file), start=2)
+
+
+def clean_car_row(row, exhibition, images=None):
+    if not isinstance(row, dict):
+        raise ValidationError('Row should be a JSON object.')
+    values = {field: str(row[field]).strip() for field in CAR_FIELDS if row.get(field) not in (None, '')}
+    car = Car(owner=exhibition, **values)
+    car.clean_fields(exclude=['owner', 'renter', 'image', 'image_derivatives'])
+    image_name = str(row.get('image') or '').strip()
+    if image_name:
+        content = images.read(image_name) if images else None
+        if content is None:
+            raise ValidationError('Image %s was not found.' % image_name)
+        try:
+            Image.open(BytesIO(content)).verify()
+        except Exception:
+            raise ValidationError('%s is not an image.' % image_name)
+        # Read again by save_cars, so a chunk does not hold every image in memory.
+        car._image_name = image_name
+    return car
+
+
+def save_cars(cars, images=None):
+    # Images reach storage only once their rows are inserted, and are deleted again if the chunk is rolled back.
+    # BEGIN IMMEDIATE without the retries of write_transaction, whose rolled back attempts would leave images behind.
+    cars_with_images = [car for car in cars if getattr(car, '_image_name', None)]
+    saved = []
+    try:
+        with immediate_atomic():
+            Car.objects.bulk_create(cars)
+            for car in cars_with_images:
+                car.image = default_storage.save('cars/' + os.path.basename(car._image_name),
+                                                 ContentFile(images.read(car._image_name)))
+                saved.append(car.image.name)
+            if cars_with_images:
+                Car.objects.bulk_update(cars_with_images, ['image'])
+            index_cars([car.id for car in cars])
+            advance_availability_epoch()
+            for car in cars_with_images:
+                schedule_derivatives(car)
+    except Exception:
+        for name in saved:
+            default_storage.delete(name)
+        raise
+
+
+def get_error_message(error):
+    if hasattr(error, 'error_dict'):
+        return ' '.join('%s: %s' % (field, ' '.join(messages)) for field, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+def import_cars(exhibition, numbered_rows, images=None, report=None, chunk_size=None):
+    # Rows are read one at a time and saved in chunks, only the first errors are kept in memory.
+    chunk_size = chunk_size or getattr(settings, 'CAR_IMPORT_CHUNK_SIZE', 500)
+    if report is None:
+        report = ErrorReport()
+    created = 0
+    cars = []
+    for line, row in numbered_rows:
+        try:
+            car = clean_car_row(row, exhibition, images)
+        except ValidationError as error:
+            report.add(line, get_error_message(error))
+            continue
+        cars.append(car)
+        if len(cars) >= chunk_size:
+            save_cars(cars, images)
+            created += len(cars)
+            cars = []
+    if cars:
+        save_cars(cars, images)
+        created += len(cars)
+    return created, report
+
+
+def import_car_file(exhibition, car_file, file_format, images=None, report=None):
+    text_file = io.TextIOWrapper(car_file, encoding='utf-8-sig', newline='')
+    try:
+        return import_cars(exhibition, read_car_rows(text_file, file_format), images, report)
+    finally:
+        text_file.detach()
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core import signals
+from django.core.asgi import get_asgi_application
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import reverse
+
+from car_rental.models import Car, Exhibition
+
+
+class InFlight:
+    # Counts the requests the application has started and not yet finished, from Django's own request_started
+    # and request_finished signals, so the peak is what the worker held open and not what the client sent.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def start(self, **kwargs):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def finish(self, **kwargs):
+        with self.lock:
+            self.current -= 1
+
+    def __enter__(self):
+        signals.request_started.connect(self.start)
+        signals.request_finished.connect(self.finish)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        signals.request_started.disconnect(self.start)
+        signals.request_finished.disconnect(self.finish)
+
+
+def asgi_scope(path):
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+
+
+async def run_asgi(path, requests, concurrency):
+    application = get_asgi_application()
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def one_request():
+        async with semaphore:
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            await application(asgi_scope(path), receive, send)
+
+    with InFlight() as in_flight:
+        await asyncio.gather(*(one_request() for i in range(requests)))
+    return in_flight.peak, statuses
+
+
+def run_wsgi(path, requests, threads):
+    application = WSGIHandler()
+    statuses = []
+
+    def one_request(i):
+        environ = RequestFactory()._base_environ(PATH_INFO=path, REQUEST_METHOD='GET', SERVER_NAME='localhost')
+        response = application(environ, lambda status, headers: statuses.append(int(status.split()[0])))
+        b''.join(response)
+        response.close()
+
+    with InFlight() as in_flight, ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(one_request, range(requests)))
+    return in_flight.peak, statuses
+
+
+class Command(BaseCommand):
+    help = 'Compare requests in flight and throughput of one ASGI worker and one threaded WSGI worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=100, help='Open connections sent to the ASGI worker.')
+        parser.add_argument('--threads', type=int, default=4, help='Threads of the WSGI worker.')
+        parser.add_argument('--cars', type=int, default=60)
+        parser.add_argument('--url', action='append', dest='urls', help='URL name, may be repeated.')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            exhibition = Exhibition.objects.create(name='benchmark')
+            Car.objects.bulk_create(Car(owner=exhibition, car_type='benchmark %d' % i)
+                                    for i in range(options['cars']))
+            for name in options['urls'] or ['car_rental:home', 'car_rental:cars']:
+                path = reverse(name)
+                for mode in ('wsgi', 'asgi'):
+                    started = time.perf_counter()
+                    if mode == 'asgi':
+                        peak, statuses = asyncio.run(run_asgi(path, options['requests'], options['concurrency']))
+                    else:
+                        peak, statuses = run_wsgi(path, options['requests'], options['threads'])
+                    elapsed = time.perf_counter() - started
+                    errors = sum(status >= 400 for status in statuses)
+                    self.stdout.write('%-22s %s  %7.1f req/s  peak in flight %4d  errors %d' % (
+                        name, mode, len(statuses) / elapsed, peak, errors))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,239 @@
+import datetime
+import itertools
+import json
+import logging
+import random
+import time
+import tracemalloc
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from car_rental import urls
+from car_rental.catalog import advance_availability_epoch
+from car_rental.query_stats import QueryRecorder
+from car_rental.models import Car, Exhibition, RentRequest, Staff, User
+from car_rental.search import index_cars
+
+PRESETS = {
+    '1k': {'exhibitions': 10, 'cars': 200, 'requests': 1000, 'renters': 100},
+    '100k': {'exhibitions': 100, 'cars': 5000, 'requests': 100000, 'renters': 2000},
+    '1m': {'exhibitions': 500, 'cars': 20000, 'requests': 1000000, 'renters': 10000},
+}
+ROLES = ('anonymous', 'renter', 'junior', 'senior')
+JUNIOR_PERMISSIONS = (('can_answer_request',), ('can_answer_request', 'can_access_car'))
+# Logging out would end the session of the role for the routes that follow.
+SKIPPED = {'logout'}
+TARGETS = {'user_info': 'renter', 'staff_detail': 'staff', 'delete_staff': 'staff', 'staff_perms': 'staff'}
+BATCH_SIZE = 5000
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values) + 0.5) - 1))]
+
+
+def bulk_create(model, objects):
+    # bulk_create makes a list of whatever it is given, so the generators are fed to it one batch at a time.
+    objects = iter(objects)
+    while True:
+        batch = list(itertools.islice(objects, BATCH_SIZE))
+        if not batch:
+            return
+        model.objects.bulk_create(batch)
+
+
+def create_users(prefix, count, is_staff=False):
+    password = make_password(None)
+    bulk_create(User, (User(username='%s%d' % (prefix, i), password=password, is_staff=is_staff)
+                       for i in range(count)))
+    return list(User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True))
+
+
+def seed(sizes, rng):
+    now = timezone.now()
+    suffix = '%x' % rng.getrandbits(32)
+    bulk_create(Exhibition, (Exhibition(name='benchmark %s %d' % (suffix, i), credit=1000)
+                             for i in range(sizes['exhibitions'])))
+    exhibition_ids = list(Exhibition.objects.filter(name__startswith='benchmark %s ' % suffix)
+                          .order_by('id').values_list('id', flat=True))
+
+    # Every exhibition gets one senior and two junior staff with different permissions.
+    staff_user_ids = create_users('benchmark_staff_%s_' % suffix, 3 * len(exhibition_ids), is_staff=True)
+    bulk_create(Staff, (Staff(user_id=user_id, exhibition_id=exhibition_ids[i // 3], is_senior=i % 3 == 0)
+                        for i, user_id in enumerate(staff_user_ids)))
+    staff_ids = dict(Staff.objects.filter(user_id__in=staff_user_ids).values_list('user_id', 'id'))
+    permissions = dict(Permission.objects.filter(codename__in=Staff.SENIOR_PERMISSIONS)
+                       .values_list('codename', 'id'))
+    UserPermission = User.user_permissions.through
+    bulk_create(UserPermission, (UserPermission(user_id=user_id, permission_id=permissions[codename])
+                                 for i, user_id in enumerate(staff_user_ids)
+                                 for codename in (Staff.SENIOR_PERMISSIONS if i % 3 == 0
+                                                  else JUNIOR_PERMISSIONS[i % 3 - 1])))
+
+    renter_ids = create_users('benchmark_renter_%s_' % suffix, sizes['renters'])
+    bulk_create(Car, (Car(owner_id=exhibition_ids[i % len(exhibition_ids)],
+                          car_type=rng.choice(['sedan', 'coupe', 'van', 'truck']) + ' %d' % i,
+                          plate='%08d' % i, price_per_hour=rng.randint(5, 50), needs_repair=i % 50 == 0,
+                          status=Car.NEEDS_REPAIR if i % 50 == 0 else Car.FREE)
+                      for i in range(sizes['cars'])))
+    car_owners = dict(Car.objects.filter(owner_id__in=exhibition_ids).values_list('id', 'owner_id'))
+    car_ids = sorted(car_owners)
+
+    def rent_requests():
+        for i in range(sizes['requests']):
+            start = now + datetime.timedelta(hours=rng.randint(-24 * 60, 24 * 30))
+            has_result = start < now or rng.random() < 0.5
+            car_id = rng.choice(car_ids)
+            yield RentRequest(car_id=car_id, exhibition_id=car_owners[car_id], requester_id=rng.choice(renter_ids),
+                              rent_start_time=start, rent_end_time=start + datetime.timedelta(hours=rng.randint(1, 72)),
+                              creation_time=start - datetime.timedelta(days=1), has_result=has_result,
+                              is_accepted=has_result and rng.random() < 0.3)
+
+    bulk_create(RentRequest, rent_requests())
+    counts = RentRequest.objects.filter(car=OuterRef('pk')).order_by().values('car').annotate(count=Count('id'))
+    Car.objects.filter(id__in=car_ids).update(
+        request_count=Coalesce(Subquery(counts.values('count'), output_field=IntegerField()), 0))
+    index_cars(car_ids)
+    advance_availability_epoch()
+
+    exhibition = exhibition_ids[0]
+    return {
+        'users': {
+            'renter': User.objects.get(id=renter_ids[0]),
+            'junior': User.objects.get(id=staff_user_ids[2]),
+            'senior': User.objects.get(id=staff_user_ids[0]),
+        },
+        'car': Car.objects.filter(owner_id=exhibition).order_by('id').values_list('id', flat=True).first(),
+        'renter': renter_ids[0],
+        'staff': staff_ids[staff_user_ids[1]],
+        'dataset': dict(sizes, staff=len(staff_user_ids)),
+    }
+
+
+def get_routes(data):
+    for pattern in urls.urlpatterns:
+        if not pattern.name or pattern.name in SKIPPED:
+            continue
+        kwargs = {name: data[TARGETS.get(pattern.name, 'car')] for name in pattern.pattern.converters}
+        yield pattern.name, reverse('%s:%s' % (urls.app_name, pattern.name), kwargs=kwargs)
+
+
+def measure(client, path, iterations):
+    client.get(path)
+    timings = []
+    queries = 0
+    for i in range(iterations):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            start = time.perf_counter()
+            response = client.get(path)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries = max(queries, recorder.count)
+        reset_queries()
+    tracemalloc.start()
+    try:
+        client.get(path)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'queries': queries,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Measure latency, query count and peak memory of every car_rental URL for every kind of user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', choices=sorted(PRESETS), default='1k')
+        for name in ('exhibitions', 'cars', 'requests', 'renters'):
+            parser.add_argument('--' + name, type=int, help='Override the number of %s of the preset.' % name)
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per URL and user.')
+        parser.add_argument('--role', action='append', dest='roles', choices=ROLES)
+        parser.add_argument('--route', action='append', dest='routes', help='URL name, may be repeated.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--current-database', action='store_true',
+                            help='Seed the configured database inside a rolled back transaction instead of a '
+                                 'throwaway test database.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--compare', help='JSON report of an earlier run to compare p95 latencies with.')
+        parser.add_argument('--threshold', type=float, default=20, help='Percent of p95 growth reported by --compare.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1.')
+        sizes = dict(PRESETS[options['preset']])
+        sizes.update({name: options[name] for name in sizes if options[name] is not None})
+        if min(sizes['exhibitions'], sizes['cars'], sizes['renters']) < 1:
+            raise CommandError('At least one exhibition, car and renter is needed.')
+        # Forbidden and not found responses are expected for some users and would flood the log.
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                if options['current_database']:
+                    report = self.benchmark(sizes, options)
+                else:
+                    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                    try:
+                        report = self.benchmark(sizes, options)
+                    finally:
+                        connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            request_logger.setLevel(level)
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(report, options['compare'], options['threshold'])
+
+    def benchmark(self, sizes, options):
+        cache.clear()
+        with transaction.atomic():
+            started = time.perf_counter()
+            data = seed(sizes, random.Random(options['seed']))
+            seconds = time.perf_counter() - started
+            results = {}
+            for role in options['roles'] or ROLES:
+                client = Client()
+                if role != 'anonymous':
+                    client.force_login(data['users'][role])
+                for name, path in get_routes(data):
+                    if options['routes'] and name not in options['routes']:
+                        continue
+                    results['%s %s' % (name, role)] = dict(measure(client, path, options['iterations']),
+                                                           route=name, role=role, path=path)
+            transaction.set_rollback(True)
+        advance_availability_epoch()
+        return {'preset': options['preset'], 'dataset': data['dataset'], 'iterations': options['iterations'],
+                'seed_seconds': round(seconds, 1), 'results': results}
+
+    def compare(self, report, baseline_file, threshold):
+        with open(baseline_file) as baseline_json:
+            baseline = json.load(baseline_json)['results']
+        for key, result in sorted(report['results'].items()):
+            before = baseline.get(key)
+            if not before or not before['p95_ms']:
+                continue
+            growth = (result['p95_ms'] - before['p95_ms']) * 100 / before['p95_ms']
+            if growth >= threshold:
+                self.stderr.write('%s: p95 %.2fms -> %.2fms (+%.0f%%), queries %d -> %d' % (
+                    key, before['p95_ms'], result['p95_ms'], growth, before['queries'], result['queries']))
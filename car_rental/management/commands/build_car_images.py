@@ -0,0 +1,47 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from car_rental.catalog import advance_availability_epoch
+from car_rental.images import generate_derivatives
+from car_rental.models import Car
+
+
+class Command(BaseCommand):
+    help = 'Build the resized copies of car images that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild the copies of every car.')
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, *args, **options):
+        cars = Car.objects.exclude(image='').exclude(image=None)
+        if not options['all']:
+            cars = cars.filter(image_derivatives={})
+        car_ids = defaultdict(list)
+        for car_id, name in cars.values_list('id', 'image'):
+            car_ids[name].append(car_id)
+        if not car_ids:
+            self.stdout.write('All car images are built.')
+            return
+        workers = options['workers'] or getattr(settings, 'CAR_IMAGE_WORKERS', 2)
+
+        def build(name):
+            try:
+                return name, generate_derivatives(name), None
+            except (OSError, ValueError) as error:
+                return name, None, error
+
+        updated = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for name, derivatives, error in executor.map(build, car_ids):
+                if error:
+                    self.stderr.write('Could not build %s: %s' % (name, error))
+                    continue
+                updated += Car.objects.filter(id__in=car_ids[name], image=name).update(image_derivatives=derivatives,
+                                                                                       updated_at=timezone.now())
+        advance_availability_epoch()
+        self.stdout.write('Built images of %d cars.' % updated)
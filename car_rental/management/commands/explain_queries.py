@@ -0,0 +1,160 @@
+import datetime
+import json
+import re
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from car_rental import views
+from car_rental.actors import get_actor
+from car_rental.catalog import get_next_change_querysets
+from car_rental.models import Car, CreditTransaction, Exhibition, RentRequest, Staff, User
+
+FULL_SCAN = re.compile(r'\bSCAN (\w+)\b(?! USING (?:COVERING )?INDEX| VIRTUAL TABLE)')
+INDEX_SCAN = re.compile(r'\bSCAN (\w+) USING (?:COVERING )?INDEX (\w+)')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR (.+)')
+
+VIEWS = [
+    ('car_rental:cars', views.CarListRenterView, 'renter', {}, {}),
+    ('car_rental:cars', views.CarListRenterView, 'renter', {}, {'car_type': 'explain'}),
+    ('car_rental:cars_staff', views.CarListStaffView, 'staff', {}, {}),
+    ('car_rental:cars_staff', views.CarListStaffView, 'staff', {}, {'ordering': '-popularity'}),
+    ('car_rental:cars_staff', views.CarListStaffView, 'staff', {}, {'ordering': 'status'}),
+    ('car_rental:cars_staff', views.CarListStaffView, 'staff', {}, {'status': 'rented'}),
+    ('car_rental:car', views.CarDetailView, 'renter', {'pk': 'car'}, {}),
+    ('car_rental:requests_renter', views.RentRequestRenterListView, 'renter', {}, {}),
+    ('car_rental:requests_staff', views.RentRequestStaffListView, 'staff', {}, {}),
+    ('car_rental:user_info', views.UserDetailView, 'staff', {'pk': 'renter'}, {}),
+    ('car_rental:staff', views.StaffListView, 'staff', {}, {}),
+    ('car_rental:staff_detail', views.StaffDetailView, 'staff', {'pk': 'staff'}, {}),
+]
+
+# The catalog lists every free car, so it reads the whole table, and search results are sorted by rank.
+ACCEPTED = {
+    'car_rental:cars': {'full scan of car_rental_car'},
+    'car_rental:cars?car_type=explain': {'temporary b-tree for order by'},
+    'Car.free_between': {'full scan of car_rental_car'},
+}
+
+
+def seed():
+    suffix = uuid.uuid4().hex[:8]
+    now = timezone.now()
+    exhibition = Exhibition.objects.create(name='explain ' + suffix)
+    staff = Staff.objects.create(user=User.objects.create_user('explain_staff_' + suffix), exhibition=exhibition,
+                                 is_senior=True)
+    other_staff = Staff.objects.create(user=User.objects.create_user('explain_other_' + suffix),
+                                       exhibition=exhibition)
+    renter = User.objects.create_user('explain_renter_' + suffix)
+    car = Car.objects.create(owner=exhibition, car_type='explain')
+    RentRequest.objects.create(car=car, requester=renter, rent_start_time=now,
+                               rent_end_time=now + datetime.timedelta(days=1))
+    return {'exhibition': exhibition, 'staff': other_staff, 'staff_user': staff.user, 'renter': renter, 'car': car}
+
+
+def get_view_queryset(name, view_class, user, kwargs, params):
+    request = RequestFactory().get(reverse(name, kwargs=kwargs), params)
+    request.user = user
+    request.actor = get_actor(user)
+    view = view_class()
+    view.setup(request, **kwargs)
+    queryset = view.get_queryset()
+    if hasattr(view, 'get_filterset'):
+        filterset = view.get_filterset(view.get_filterset_class())
+        if not filterset.is_bound or filterset.is_valid():
+            queryset = filterset.qs
+    if hasattr(view, 'get_keyset_fields'):
+        return queryset.order_by(*view.get_keyset_fields())[:view.paginate_by + 1]
+    if 'pk' in kwargs:
+        return queryset.filter(pk=kwargs['pk'])
+    return queryset
+
+
+def get_querysets(data):
+    now = timezone.now()
+    users = {'renter': data['renter'], 'staff': data['staff_user']}
+    for name, view_class, user, kwargs, params in VIEWS:
+        kwargs = {key: data[value].pk for key, value in kwargs.items()}
+        label = name + ('?' + '&'.join('%s=%s' % item for item in params.items()) if params else '')
+        yield label, get_view_queryset(name, view_class, users[user], kwargs, params)
+    tomorrow = now + datetime.timedelta(days=1)
+    yield 'Car.free_between', Car.objects.filter(needs_repair=False).free_between(now, tomorrow)
+    yield 'Exhibition.has_customer', data['exhibition'].get_all_requests().filter(requester_id=data['renter'].id)
+    yield 'RentRequest.answer', RentRequest.objects.accepted().filter(car_id__in=[data['car'].id]) \
+        .overlapping(now, tomorrow)
+    yield 'Car.get_next_free_time', RentRequest.objects.filter(car=data['car'], rent_end_time__gt=now).accepted() \
+        .order_by('rent_start_time')
+    yield 'rent_request_view pending', RentRequest.objects.filter(car=data['car'], requester=data['renter'],
+                                                                  has_result=False).overlapping(now, tomorrow)
+    yield 'new_requests_staff_view', data['exhibition'].get_pending_requests().filter(id__gt=0).order_by('id')[:50]
+    for index, queryset in enumerate(get_next_change_querysets(now)):
+        yield 'get_next_change %d' % (index + 1), queryset
+    yield 'CreditTransaction.history', CreditTransaction.objects.for_account(data['renter']).order_by('-id')[:20]
+
+
+def check_plan(plan):
+    problems = []
+    for table in FULL_SCAN.findall(plan):
+        problems.append('full scan of ' + table)
+    for table, index in INDEX_SCAN.findall(plan):
+        problems.append('full scan of %s through %s' % (table, index))
+    for purpose in TEMP_SORT.findall(plan):
+        problems.append('temporary b-tree for ' + purpose.lower())
+    return problems
+
+
+class Command(BaseCommand):
+    help = 'Report full table scans and temporary sorts in the query plans of the list and detail views.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--current-database', action='store_true',
+                            help='Seed the configured database inside a rolled back transaction instead of a '
+                                 'throwaway test database.')
+        parser.add_argument('--plans', action='store_true', help='Print every query plan.')
+        parser.add_argument('--json', action='store_true')
+        parser.add_argument('--fail', action='store_true', help='Exit with an error if any problem is found.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('explain_queries reads SQLite query plans.')
+        if options['current_database']:
+            reports = self.explain()
+        else:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                reports = self.explain()
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+        else:
+            for report in reports:
+                status = self.style.ERROR('CHECK') if report['problems'] else self.style.SUCCESS('OK')
+                self.stdout.write('%s %s' % (status, report['query']))
+                for problem in report['problems']:
+                    self.stdout.write('    ' + problem)
+                for problem in report['accepted']:
+                    self.stdout.write('    %s (accepted)' % problem)
+                if options['plans']:
+                    for line in report['plan'].splitlines():
+                        self.stdout.write('      | ' + line)
+        problems = sum(len(report['problems']) for report in reports)
+        if options['fail'] and problems:
+            raise CommandError('%d query plan problems found.' % problems)
+
+    def explain(self):
+        with transaction.atomic():
+            data = seed()
+            reports = []
+            for label, queryset in get_querysets(data):
+                plan = queryset.explain()
+                problems = check_plan(plan)
+                accepted = [problem for problem in problems if problem in ACCEPTED.get(label, ())]
+                reports.append({'query': label, 'plan': plan, 'accepted': accepted,
+                                'problems': [problem for problem in problems if problem not in accepted]})
+            transaction.set_rollback(True)
+        return reports
@@ -0,0 +1,54 @@
+import csv
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from car_rental.imports import ErrorReport, import_cars, open_images, read_car_rows
+from car_rental.models import Exhibition
+
+
+class Command(BaseCommand):
+    help = 'Import cars of an exhibition from a CSV or JSONL file with car_type, plate, price_per_hour and image ' \
+           'fields.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('exhibition_id', type=int)
+        parser.add_argument('car_file')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='Defaults to the file extension.')
+        parser.add_argument('--images', help='Directory or ZIP archive the image names are read from.')
+        parser.add_argument('--report', help='Write every row error to this CSV file.')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Cars inserted per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            exhibition = Exhibition.objects.get(id=options['exhibition_id'])
+        except Exhibition.DoesNotExist:
+            raise CommandError('Exhibition %s does not exist.' % options['exhibition_id'])
+        file_format = options['format'] or ('jsonl' if options['car_file'].endswith(('.jsonl', '.ndjson')) else 'csv')
+        images = None
+        if options['images']:
+            try:
+                images = open_images(options['images'])
+            except (OSError, zipfile.BadZipFile) as error:
+                raise CommandError('Cannot read images from %s: %s' % (options['images'], error))
+        report_file = open(options['report'], 'w', newline='') if options['report'] else None
+        try:
+            report = ErrorReport(csv.writer(report_file) if report_file else None)
+            if report_file:
+                report.writer.writerow(['line', 'error'])
+            with open(options['car_file'], newline='', encoding='utf-8-sig') as car_file:
+                created, report = import_cars(exhibition, read_car_rows(car_file, file_format), images, report,
+                                              options['chunk_size'])
+        except UnicodeDecodeError as error:
+            raise CommandError('%s is not UTF-8 text: %s' % (options['car_file'], error))
+        finally:
+            if images:
+                images.close()
+            if report_file:
+                report_file.close()
+        if not report_file:
+            for line, error in report.errors:
+                self.stderr.write('Line %d: %s' % (line, error))
+            if report.count > len(report.errors):
+                self.stderr.write('%d more rows have errors.' % (report.count - len(report.errors)))
+        self.stdout.write('Imported %d cars, %d rows have errors.' % (created, report.count))
@@ -0,0 +1,29 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from car_rental.imports import import_staff
+from car_rental.models import Exhibition
+
+
+class Command(BaseCommand):
+    help = 'Import staff of an exhibition from a CSV file with username, password and type (N or S) columns.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('exhibition_id', type=int)
+        parser.add_argument('csv_file')
+        parser.add_argument('--workers', type=int, default=None, help='Number of password hashing processes.')
+
+    def handle(self, *args, **options):
+        try:
+            exhibition = Exhibition.objects.get(id=options['exhibition_id'])
+        except Exhibition.DoesNotExist:
+            raise CommandError('Exhibition %s does not exist.' % options['exhibition_id'])
+        try:
+            with open(options['csv_file'], newline='', encoding='utf-8-sig') as csv_file:
+                created, errors = import_staff(exhibition, csv.DictReader(csv_file), options['workers'])
+        except UnicodeDecodeError as error:
+            raise CommandError('%s is not UTF-8 text: %s' % (options['csv_file'], error))
+        for line, error in errors:
+            self.stderr.write('Line %d: %s' % (line, error))
+        self.stdout.write('Imported %d staff.' % created)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from car_rental.models import Car
+from car_rental.search import index_cars
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the car search index, e.g. after cars were changed with bulk updates.'
+
+    def handle(self, *args, **options):
+        car_ids = list(Car.objects.values_list('id', flat=True))
+        index_cars(car_ids)
+        self.stdout.write('Indexed %d cars.' % len(car_ids))
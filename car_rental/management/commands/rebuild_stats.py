@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from car_rental.models import DailyCarStats, DailyExhibitionStats, rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily exhibition and car rollups from every answered rent request.'
+
+    def handle(self, *args, **options):
+        counts = rebuild_daily_stats()
+        self.stdout.write('Rebuilt %d exhibition days and %d car days.' % (counts[DailyExhibitionStats],
+                                                                           counts[DailyCarStats]))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from car_rental.models import CreditSnapshot, CreditTransaction, Exhibition, User
+
+
+class Command(BaseCommand):
+    help = 'Snapshot the credit balance of every account that has new ledger transactions.'
+
+    def handle(self, *args, **options):
+        last_snapshot_id = CreditSnapshot.objects.aggregate(last=Max('last_transaction_id'))['last'] or 0
+        new_transactions = CreditTransaction.objects.filter(id__gt=last_snapshot_id)
+        last_transaction_id = new_transactions.aggregate(last=Max('id'))['last']
+        if last_transaction_id is None:
+            self.stdout.write('No new transactions.')
+            return
+        new_transactions = new_transactions.filter(id__lte=last_transaction_id)
+        user_ids = new_transactions.exclude(user=None).values_list('user_id', flat=True).distinct()
+        exhibition_ids = new_transactions.exclude(exhibition=None).values_list('exhibition_id', flat=True).distinct()
+        accounts = list(User.objects.filter(id__in=user_ids)) + list(Exhibition.objects.filter(id__in=exhibition_ids))
+        snapshots = []
+        for account in accounts:
+            balance = CreditTransaction.objects.filter(id__lte=last_transaction_id).balance(account)
+            if balance != account.credit:
+                self.stderr.write('Balance of %s is %d but the ledger says %d.' % (account, account.credit, balance))
+            if isinstance(account, Exhibition):
+                snapshots.append(CreditSnapshot(exhibition=account, balance=balance,
+                                                last_transaction_id=last_transaction_id))
+            else:
+                snapshots.append(CreditSnapshot(user=account, balance=balance, last_transaction_id=last_transaction_id))
+        CreditSnapshot.objects.bulk_create(snapshots)
+        self.stdout.write('Saved %d snapshots.' % len(snapshots))
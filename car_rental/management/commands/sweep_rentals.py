@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from car_rental.models import sweep_rentals
+
+
+class Command(BaseCommand):
+    help = 'Move cars whose rental started or ended to the rented or free status.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Cars updated per transaction.')
+        parser.add_argument('--interval', type=int, default=None,
+                            help='Keep sweeping every this many seconds instead of sweeping once.')
+
+    def handle(self, *args, **options):
+        while True:
+            counts = sweep_rentals(batch_size=options['batch_size'])
+            self.stdout.write('%(started)d rentals started, %(ended)d ended, %(rolled)d moved to the next booking.'
+                              % counts)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,69 @@
+import asyncio
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from car_rental.actors import get_actor
+from car_rental.query_stats import QueryRecorder, current_recorder, query_stats
+
+
+class QueryStatsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, 'QUERY_STATS_ENABLED', False):
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.record(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'QUERY_STATS_ENABLED', False):
+            return await self.get_response(request)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.record(request, recorder)
+        return response
+
+    def record(self, request, recorder):
+        if request.resolver_match:
+            query_stats.record(request.resolver_match.view_name, recorder)
+
+
+class ActorMiddleware:
+    # Loads request.actor right after AuthenticationMiddleware, in a worker thread for async requests, so
+    # views and templates read the staff row, exhibition and permissions without further queries.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.actor = get_actor(request.user)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.actor = await sync_to_async(get_actor)(request.user)
+        return await self.get_response(request)
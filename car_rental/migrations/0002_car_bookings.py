@@ -0,0 +1,17 @@
+# Generated by Django 4.0.2 on 2026-10-17 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rentrequest',
+            index=models.Index(fields=['car', 'is_accepted', 'rent_start_time', 'rent_end_time'], name='rentrequest_booking_idx'),
+        ),
+    ]
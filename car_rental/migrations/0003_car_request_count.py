@@ -0,0 +1,28 @@
+# Generated by Django 4.0.2 on 2026-10-17 22:58
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_requests(apps, schema_editor):
+    Car = apps.get_model('car_rental', 'Car')
+    RentRequest = apps.get_model('car_rental', 'RentRequest')
+    counts = RentRequest.objects.filter(car=OuterRef('pk')).order_by().values('car').annotate(count=Count('id'))
+    Car.objects.update(request_count=Coalesce(Subquery(counts.values('count'), output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0002_car_bookings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='request_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(count_requests, migrations.RunPython.noop),
+    ]
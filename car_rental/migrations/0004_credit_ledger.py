@@ -0,0 +1,67 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def open_snapshots(apps, schema_editor):
+    User = apps.get_model('car_rental', 'User')
+    Exhibition = apps.get_model('car_rental', 'Exhibition')
+    CreditSnapshot = apps.get_model('car_rental', 'CreditSnapshot')
+    snapshots = [CreditSnapshot(user_id=pk, balance=credit)
+                 for pk, credit in User.objects.exclude(credit=0).values_list('pk', 'credit')]
+    snapshots += [CreditSnapshot(exhibition_id=pk, balance=credit)
+                  for pk, credit in Exhibition.objects.exclude(credit=0).values_list('pk', 'credit')]
+    CreditSnapshot.objects.bulk_create(snapshots)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0003_car_request_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreditTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField()),
+                ('reason', models.CharField(choices=[('TOP_UP', 'Credit change'), ('RENT', 'Rent'), ('REPAIR', 'Repair')], default='TOP_UP', max_length=10)),
+                ('creation_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Time')),
+                ('exhibition', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credit_transactions', to='car_rental.exhibition')),
+                ('rent_request', models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='car_rental.rentrequest')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credit_transactions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CreditSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.IntegerField()),
+                ('last_transaction_id', models.BigIntegerField(default=0)),
+                ('creation_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('exhibition', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credit_snapshots', to='car_rental.exhibition')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credit_snapshots', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='credittransaction',
+            index=models.Index(fields=['user', 'id'], name='credittransaction_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='credittransaction',
+            index=models.Index(fields=['exhibition', 'id'], name='credittransaction_ex_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creditsnapshot',
+            index=models.Index(fields=['user', 'last_transaction_id'], name='creditsnapshot_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creditsnapshot',
+            index=models.Index(fields=['exhibition', 'last_transaction_id'], name='creditsnapshot_ex_idx'),
+        ),
+        migrations.RunPython(open_snapshots, migrations.RunPython.noop),
+    ]
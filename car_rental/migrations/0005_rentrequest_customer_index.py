@@ -0,0 +1,17 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0004_credit_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rentrequest',
+            index=models.Index(fields=['requester', 'car'], name='rentrequest_customer_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0005_rentrequest_customer_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:16
+
+import re
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+import django.db.models.deletion
+
+
+def build_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute("CREATE VIRTUAL TABLE car_rental_car_fts USING fts5("
+                                  "car_type, plate, owner_name, tokenize = 'unicode61')")
+        except OperationalError:
+            pass
+        else:
+            schema_editor.execute("INSERT INTO car_rental_car_fts (rowid, car_type, plate, owner_name) "
+                                  "SELECT car.id, car.car_type, car.plate, COALESCE(exhibition.name, '') "
+                                  "FROM car_rental_car car "
+                                  "LEFT JOIN car_rental_exhibition exhibition ON exhibition.id = car.owner_id")
+            return
+    Car = apps.get_model('car_rental', 'Car')
+    CarSearchToken = apps.get_model('car_rental', 'CarSearchToken')
+    tokens = []
+    for car_id, car_type, plate, owner_name in Car.objects.values_list('id', 'car_type', 'plate', 'owner__name'):
+        for token in set(re.findall(r'\w+', ' '.join([car_type or '', plate or '', owner_name or '']).lower())):
+            tokens.append(CarSearchToken(car_id=car_id, token=token[:50]))
+    CarSearchToken.objects.bulk_create(tokens, batch_size=500)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS car_rental_car_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0006_car_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(db_index=True, max_length=50)),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='car_rental.car')),
+            ],
+        ),
+        migrations.RunPython(build_index, drop_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0007_car_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['owner', 'rent_end_time'], name='car_owner_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['owner', 'request_count'], name='car_owner_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['needs_repair', 'rent_end_time'], name='car_repair_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentrequest',
+            index=models.Index(fields=['car', 'has_result', 'rent_start_time'], name='rentrequest_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentrequest',
+            index=models.Index(fields=['requester', 'rent_start_time'], name='rentrequest_renter_idx'),
+        ),
+    ]
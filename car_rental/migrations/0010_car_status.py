@@ -0,0 +1,38 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:47
+
+from django.db import migrations, models
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+
+def set_status(apps, schema_editor):
+    Car = apps.get_model('car_rental', 'Car')
+    now = timezone.now()
+    Car.objects.update(status=Case(When(needs_repair=True, then=Value('needs_repair')),
+                                   When(renter__isnull=False, rent_start_time__lte=now, rent_end_time__gt=now,
+                                        then=Value('rented')),
+                                   default=Value('free')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0009_car_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='status',
+            field=models.CharField(choices=[('free', 'free'), ('rented', 'rented'), ('needs_repair', 'needs repair')], default='free', max_length=12),
+        ),
+        migrations.RunPython(set_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['owner', 'status'], name='car_owner_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['status', 'rent_end_time'], name='car_status_end_idx'),
+        ),
+    ]
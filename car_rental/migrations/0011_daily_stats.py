@@ -0,0 +1,46 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0010_car_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyExhibitionStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('rented_hours', models.PositiveIntegerField(default=0)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('rejections', models.PositiveIntegerField(default=0)),
+                ('exhibition', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='car_rental.exhibition')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyCarStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('rented_hours', models.PositiveIntegerField(default=0)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('rejections', models.PositiveIntegerField(default=0)),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='car_rental.car')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyexhibitionstats',
+            constraint=models.UniqueConstraint(fields=('exhibition', 'day'), name='daily_exhibition_stats_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycarstats',
+            constraint=models.UniqueConstraint(fields=('car', 'day'), name='daily_car_stats_unique'),
+        ),
+    ]
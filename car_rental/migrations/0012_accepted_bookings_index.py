@@ -0,0 +1,17 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0011_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rentrequest',
+            index=models.Index(condition=models.Q(('is_accepted', True)), fields=['car', 'rent_start_time', 'rent_end_time'], name='rentrequest_accepted_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.2 on 2026-10-17 23:55
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def set_exhibition(apps, schema_editor):
+    Car = apps.get_model('car_rental', 'Car')
+    RentRequest = apps.get_model('car_rental', 'RentRequest')
+    RentRequest.objects.filter(car__isnull=False).update(
+        exhibition=Subquery(Car.objects.filter(pk=OuterRef('car_id')).values('owner_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0012_accepted_bookings_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rentrequest',
+            name='exhibition',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='car_rental.exhibition'),
+        ),
+        migrations.RunPython(set_exhibition, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='rentrequest',
+            index=models.Index(condition=models.Q(('has_result', False)), fields=['exhibition', 'rent_start_time', 'id'], name='rentrequest_pending_idx'),
+        ),
+    ]
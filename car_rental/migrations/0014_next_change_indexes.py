@@ -0,0 +1,29 @@
+# Generated by Django 4.0.2 on 2026-10-18 00:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0013_rentrequest_exhibition'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(condition=models.Q(('renter__isnull', False)), fields=['rent_start_time'], name='car_window_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(condition=models.Q(('renter__isnull', False)), fields=['rent_end_time'], name='car_window_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentrequest',
+            index=models.Index(condition=models.Q(('is_accepted', True)), fields=['rent_start_time'], name='rentrequest_booking_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentrequest',
+            index=models.Index(condition=models.Q(('is_accepted', True)), fields=['rent_end_time'], name='rentrequest_booking_end_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.2 on 2026-10-18 00:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0014_next_change_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='rentrequest',
+            name='rentrequest_booking_idx',
+        ),
+    ]
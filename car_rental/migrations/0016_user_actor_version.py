@@ -0,0 +1,19 @@
+# Generated by Django 4.0.2 on 2026-10-18 00:35
+
+import car_rental.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_rental', '0015_drop_booking_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='actor_version',
+            field=models.BigIntegerField(default=car_rental.models.new_actor_version, editable=False),
+        ),
+    ]
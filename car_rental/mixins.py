@@ -0,0 +1,137 @@
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class RelationLoadingMixin:
+    select_related = ()
+    prefetch_related = ()
+    only_fields = ()
+
+    def get_base_queryset(self):
+        return super(RelationLoadingMixin, self).get_queryset()
+
+    def get_queryset(self):
+        queryset = self.get_base_queryset()
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.only_fields:
+            queryset = queryset.only(*self.only_fields)
+        return queryset
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(model, fields, cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(fields):
+            return None
+        return [model._meta.get_field(name.lstrip('-')).to_python(value) for name, value in zip(fields, values)]
+    except (ValueError, TypeError, binascii.Error, ValidationError):
+        return None
+
+
+def reverse_ordering(fields):
+    return [name[1:] if name.startswith('-') else '-' + name for name in fields]
+
+
+def after_filter(fields, values):
+    condition = Q()
+    for index, name in enumerate(fields):
+        lookup = name.lstrip('-') + ('__lt' if name.startswith('-') else '__gt')
+        key_condition = Q(**{lookup: values[index]})
+        for previous_name, previous_value in zip(fields[:index], values[:index]):
+            key_condition &= Q(**{previous_name.lstrip('-'): previous_value})
+        condition |= key_condition
+    return condition
+
+
+class KeysetPaginationMixin:
+    # Cursor pagination on a stable, unique ordering. Page N costs the same as page 1 and no COUNT(*) runs
+    # unless keyset_count is 'cached' (exact, cached for keyset_count_timeout seconds) or 'bounded'
+    # (counted up to keyset_count_limit rows).
+    paginate_by = 7
+    table_pagination = False
+    keyset_fields = ('id',)
+    keyset_orderings = {}
+    keyset_count = None
+    keyset_count_timeout = 60
+    keyset_count_limit = 1000
+
+    def get_paginate_by(self, queryset):
+        return None
+
+    def get_table_kwargs(self):
+        kwargs = super(KeysetPaginationMixin, self).get_table_kwargs()
+        kwargs['orderable'] = False
+        return kwargs
+
+    def get_keyset_fields(self):
+        return self.keyset_orderings.get(self.request.GET.get('ordering'), self.keyset_fields)
+
+    def get_keyset_count(self, queryset):
+        if self.keyset_count == 'cached':
+            query = str(queryset.order_by().query)
+            cache_key = 'keyset_count_' + hashlib.md5(query.encode()).hexdigest()
+            return cache.get_or_set(cache_key, queryset.count, self.keyset_count_timeout), False
+        if self.keyset_count == 'bounded':
+            count = queryset.order_by()[:self.keyset_count_limit + 1].count()
+            return min(count, self.keyset_count_limit), count > self.keyset_count_limit
+        return None, False
+
+    def get_page_url(self, name, cursor):
+        params = self.request.GET.copy()
+        params.pop('after', None)
+        params.pop('before', None)
+        params[name] = cursor
+        return '?' + params.urlencode()
+
+    def paginate_keyset(self, queryset):
+        fields = list(self.get_keyset_fields())
+        model = queryset.model
+        total, more = self.get_keyset_count(queryset)
+        after = decode_cursor(model, fields, self.request.GET.get('after', ''))
+        before = decode_cursor(model, fields, self.request.GET.get('before', ''))
+        if before is not None:
+            rows = list(queryset.filter(after_filter(reverse_ordering(fields), before))
+                        .order_by(*reverse_ordering(fields))[:self.paginate_by + 1])
+            has_previous = len(rows) > self.paginate_by
+            rows = rows[:self.paginate_by][::-1]
+            has_next = True
+        else:
+            if after is not None:
+                queryset = queryset.filter(after_filter(fields, after))
+            rows = list(queryset.order_by(*fields)[:self.paginate_by + 1])
+            has_next = len(rows) > self.paginate_by
+            rows = rows[:self.paginate_by]
+            has_previous = after is not None
+
+        def cursor(row):
+            return encode_cursor([getattr(row, name.lstrip('-')) for name in fields])
+
+        keyset_page = {
+            'next_url': self.get_page_url('after', cursor(rows[-1])) if rows and has_next else None,
+            'previous_url': self.get_page_url('before', cursor(rows[0])) if rows and has_previous else None,
+            'total': total,
+            'more': more,
+        }
+        return rows, keyset_page
+
+    def get_context_data(self, **kwargs):
+        rows, keyset_page = self.paginate_keyset(self.object_list)
+        self.object_list = rows
+        kwargs['keyset_page'] = keyset_page
+        kwargs.pop('object_list', None)
+        return super(KeysetPaginationMixin, self).get_context_data(object_list=rows, **kwargs)
@@ -1,25 +1,65 @@
 import datetime
+import secrets
+from collections import defaultdict
 from math import ceil
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser, Permission
-from django.db import models
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import Case, Exists, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, \
+    Value, When
+from django.db.models.functions import Cast, Greatest, Round
 from django.urls import reverse
 from django.utils import timezone
 
+from .catalog import advance_availability_epoch
+from .fragments import FRAGMENT_CACHE, get_car_fragment_keys
+from .events import exhibition_channel, publish, user_channel
+from .search import unindex_cars
+from .transactions import write_transaction
+
+
+def new_actor_version():
+    return secrets.randbits(62)
+
 
 def get_tomorrow():
     return timezone.now() + datetime.timedelta(days=1)
 
 
+def get_rent_hours(start_time, end_time):
+    delta_time = end_time - start_time
+    return delta_time.days * 24 + ceil(delta_time.seconds/3600)
+
+
 class User(AbstractUser):
     credit = models.IntegerField(default=0)
-
-    def change_credit(self, delta_credit):
+    # Part of the cache key of the actor context, replaced by actors.invalidate_actor so every worker stops
+    # reading the old context on the next request. Random rather than counted, so a rolled back change or a
+    # reused id never lands on a key that is still cached.
+    actor_version = models.BigIntegerField(default=new_actor_version, editable=False)
+
+    def save(self, *args, **kwargs):
+        # A full save of an instance loaded before an invalidation must not write the old version back.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'actor_version']
+        super(User, self).save(*args, **kwargs)
+
+    def change_credit(self, delta_credit, reason='TOP_UP'):
         if self.is_staff:
-            self.staff.exhibition.change_credit(delta_credit)
+            self.staff.exhibition.change_credit(delta_credit, reason)
         else:
-            self.credit += delta_credit
-            self.save()
+            apply_credit_transactions([self.credit_transaction(delta_credit, reason)])
+            self.refresh_from_db(fields=['credit'])
+
+    def credit_transaction(self, amount, reason, rent_request=None):
+        if self.is_staff:
+            return CreditTransaction(exhibition_id=self.staff.exhibition_id, amount=amount, reason=reason,
+                                     rent_request=rent_request)
+        return CreditTransaction(user=self, amount=amount, reason=reason, rent_request=rent_request)
 
     def __str__(self):
         return self.username + " :  " + ('Car Exhibition' if self.is_staff else 'Renter')
@@ -35,9 +75,36 @@ class Exhibition(models.Model):
     def get_all_requests(self):
         return RentRequest.objects.filter(car__owner=self)
 
-    def change_credit(self, delta_credit):
-        self.credit += delta_credit
-        self.save()
+    def get_pending_requests(self):
+        # Reads rentrequest_pending_idx in queue order instead of sorting the requests of every car.
+        return RentRequest.objects.filter(exhibition=self, has_result=False, car__isnull=False)
+
+    def get_customers(self):
+        return User.objects.filter(Exists(self.get_all_requests().filter(requester=OuterRef('pk'))))
+
+    def has_customer(self, user_id):
+        timeout = getattr(settings, 'EXHIBITION_CUSTOMER_CACHE_TIMEOUT', 0)
+        if not timeout:
+            return self.get_customers().filter(pk=user_id).exists()
+        cache_key = Exhibition.customers_cache_key(self.pk)
+        customer_ids = cache.get(cache_key)
+        if customer_ids is None:
+            customer_ids = set(self.get_all_requests().values_list('requester_id', flat=True).distinct())
+            cache.set(cache_key, customer_ids, timeout)
+        return int(user_id) in customer_ids
+
+    @staticmethod
+    def customers_cache_key(exhibition_id):
+        return 'exhibition_customers_%s' % exhibition_id
+
+    def change_credit(self, delta_credit, reason='TOP_UP'):
+        # Read back rather than added in place: the exhibition of a cached actor has credit deferred, and
+        # loading it after the update would count the delta twice.
+        apply_credit_transactions([self.credit_transaction(delta_credit, reason)])
+        self.refresh_from_db(fields=['credit'])
+
+    def credit_transaction(self, amount, reason, rent_request=None):
+        return CreditTransaction(exhibition=self, amount=amount, reason=reason, rent_request=rent_request)
 
 
 class StaffManager(models.Manager):
@@ -48,13 +115,15 @@ class StaffManager(models.Manager):
         user.is_staff = True
         user.save()
         if staff.is_senior:
-            staff.add_permissions('can_access_credit', 'can_answer_request', 'can_access_car', 'can_access_staff')
+            staff.add_permissions(*Staff.SENIOR_PERMISSIONS)
         else:
             staff.remove_permissions('can_access_credit')
         return staff
 
 
 class Staff(models.Model):
+    SENIOR_PERMISSIONS = ('can_access_credit', 'can_answer_request', 'can_access_car', 'can_access_staff')
+
     is_senior = models.BooleanField(default=False)
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     exhibition = models.ForeignKey(Exhibition, on_delete=models.CASCADE)
@@ -64,20 +133,70 @@ class Staff(models.Model):
         permissions = (('can_access_staff', 'Can access staff'),)
 
     def add_permissions(self, *codenames):
-        for codename in codenames:
-            permission = Permission.objects.get(codename=codename)
-            self.user.user_permissions.add(permission)
+        self.user.user_permissions.add(*Permission.objects.filter(codename__in=codenames))
 
     def remove_permissions(self, *codenames):
-        for codename in codenames:
-            permission = Permission.objects.get(codename=codename)
-            self.user.user_permissions.remove(permission)
+        self.user.user_permissions.remove(*Permission.objects.filter(codename__in=codenames))
 
     def get_absolute_url(self):
         return reverse('car_rental:staff_detail', kwargs={'pk': self.id})
 
 
+class CarQuerySet(models.QuerySet):
+
+    def free_between(self, start_time, end_time):
+        bookings = RentRequest.objects.filter(car=OuterRef('pk')).accepted().overlapping(start_time, end_time)
+        window = Q(rent_start_time__lt=end_time, rent_end_time__gt=start_time)
+        return self.exclude(window & Q(renter__isnull=False)).filter(~Exists(bookings))
+
+    def without_bookings_after(self, now):
+        # Cars that can be edited or deleted without touching a paid rental that is running or yet to come.
+        bookings = RentRequest.objects.filter(car=OuterRef('pk'), rent_end_time__gt=now).accepted()
+        return self.filter(Q(renter__isnull=True) | Q(rent_end_time__lte=now)).filter(~Exists(bookings))
+
+    def popular(self):
+        return self.filter(request_count__gte=getattr(settings, 'POPULAR_CAR_REQUEST_COUNT', 3))
+
+    def reprice(self, percent=None, amount=None):
+        if amount is not None:
+            return self.update_fleet(price_per_hour=amount)
+        price = ExpressionWrapper(F('price_per_hour') * Value((100 + percent) / 100), output_field=FloatField())
+        return self.update_fleet(price_per_hour=Greatest(Cast(Round(price), IntegerField()), Value(1)))
+
+    def set_needs_repair(self, needs_repair):
+        if needs_repair:
+            return self.update_fleet(needs_repair=True, status=Car.NEEDS_REPAIR)
+        return self.update_fleet(needs_repair=False, status=Car.get_rent_status_expression(timezone.now()))
+
+    def update_fleet(self, **values):
+        updated = self.update(updated_at=timezone.now(), **values)
+        if updated:
+            advance_availability_epoch()
+        return updated
+
+    def delete_fleet(self):
+        # One statement per table instead of Model.delete, whose post_delete signals unindex each car, drop its
+        # fragments and advance the availability epoch once per car. Those run once for the whole fleet here.
+        cars = list(self.values_list('id', 'updated_at'))
+        car_ids = [car_id for car_id, updated_at in cars]
+        if not car_ids:
+            return 0
+        RentRequest.objects.using(self.db).filter(car_id__in=car_ids).update(car=None)
+        DailyCarStats.objects.using(self.db).filter(car_id__in=car_ids).delete()
+        unindex_cars(car_ids, self.db)
+        deleted = Car.objects.using(self.db).filter(id__in=car_ids)._raw_delete(self.db)
+        caches[FRAGMENT_CACHE].delete_many([key for car_id, updated_at in cars
+                                            for key in get_car_fragment_keys(car_id, updated_at)])
+        advance_availability_epoch()
+        return deleted
+
+
 class Car(models.Model):
+    FREE = 'free'
+    RENTED = 'rented'
+    NEEDS_REPAIR = 'needs_repair'
+    STATUS_CHOICES = ((FREE, 'free'), (RENTED, 'rented'), (NEEDS_REPAIR, 'needs repair'))
+
     car_type = models.CharField(max_length=50, default='type0')
     plate = models.CharField(max_length=8, default='12345678')
     renter = models.ForeignKey(User, null=True, default=None, on_delete=models.SET_NULL, related_name='cars_rented')
@@ -87,20 +206,90 @@ class Car(models.Model):
     rent_end_time = models.DateTimeField('End Time', default=timezone.now)
     needs_repair = models.BooleanField(default=False)
     image = models.ImageField(upload_to='cars', null=True, blank=True, default='default.jpg')
+    image_derivatives = models.JSONField(default=dict, blank=True)
+    request_count = models.PositiveIntegerField(default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Kept in step with needs_repair and the rent window by save() and answer(), rentals that start or
+    # end later are moved by the sweep_rentals command.
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=FREE)
+    objects = CarQuerySet.as_manager()
 
     class Meta:
         permissions = (('can_access_car', 'Can access car'),)
+        indexes = [
+            models.Index(fields=['owner', 'rent_end_time'], name='car_owner_end_idx'),
+            models.Index(fields=['owner', 'request_count'], name='car_owner_popularity_idx'),
+            models.Index(fields=['needs_repair', 'rent_end_time'], name='car_repair_end_idx'),
+            models.Index(fields=['owner', 'status'], name='car_owner_status_idx'),
+            models.Index(fields=['status', 'rent_end_time'], name='car_status_end_idx'),
+            # Rental windows in time order, read by catalog.get_next_change.
+            models.Index(fields=['rent_start_time'], condition=Q(renter__isnull=False), name='car_window_start_idx'),
+            models.Index(fields=['rent_end_time'], condition=Q(renter__isnull=False), name='car_window_end_idx'),
+        ]
 
     def __str__(self):
         return str(self.pk) + ". " + self.car_type
 
+    def save(self, *args, **kwargs):
+        self.status = self.get_status()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'status' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['status']
+        super(Car, self).save(*args, **kwargs)
+
+    def get_status(self, now=None):
+        now = now or timezone.now()
+        if self.needs_repair:
+            return Car.NEEDS_REPAIR
+        if self.renter_id and self.rent_start_time <= now < self.rent_end_time:
+            return Car.RENTED
+        return Car.FREE
+
+    @staticmethod
+    def get_rent_status_expression(now):
+        return Case(When(renter__isnull=False, rent_start_time__lte=now, rent_end_time__gt=now, then=Value(Car.RENTED)),
+                    default=Value(Car.FREE))
+
     def is_rented(self):
-        return self.rent_end_time > timezone.now()
+        return self.rent_start_time <= timezone.now() < self.rent_end_time
+
+    def is_free_between(self, start_time, end_time):
+        return Car.objects.filter(pk=self.pk).free_between(start_time, end_time).exists()
+
+    def is_without_bookings_after(self, now):
+        return Car.objects.filter(pk=self.pk).without_bookings_after(now).exists()
+
+    def get_next_free_time(self, start_time, end_time):
+        # Earliest time from start_time on when the car is free for as long as the requested window. Accepted
+        # bookings are read in start order from rentrequest_accepted_idx until a long enough gap shows up.
+        duration = end_time - start_time
+        bookings = RentRequest.objects.filter(car=self, rent_end_time__gt=start_time).accepted() \
+            .order_by('rent_start_time').values_list('rent_start_time', 'rent_end_time')
+        free_time = start_time
+        if self.renter_id and self.rent_start_time < end_time and self.rent_end_time > start_time:
+            free_time = self.rent_end_time
+        for booking_start, booking_end in bookings.iterator():
+            if booking_start >= free_time + duration:
+                break
+            free_time = max(free_time, booking_end)
+        return free_time
 
     def set_renter(self, renter):
         self.renter = renter
         self.save()
 
+    def get_image_derivatives(self):
+        return sorted((int(width), name) for width, name in self.image_derivatives.items())
+
+    def image_thumbnail_url(self):
+        derivatives = self.get_image_derivatives()
+        if derivatives:
+            return default_storage.url(derivatives[0][1])
+        return self.image.url if self.image else ''
+
+    def image_srcset(self):
+        return ', '.join('%s %sw' % (default_storage.url(name), width) for width, name in self.get_image_derivatives())
+
     def set_owner(self, owner):
         self.owner = owner
         self.save()
@@ -109,6 +298,92 @@ class Car(models.Model):
         return reverse('car_rental:car', kwargs={'pk': self.id})
 
 
+class CarSearchToken(models.Model):
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=50, db_index=True)
+
+
+class RentRequestQuerySet(models.QuerySet):
+
+    def accepted(self):
+        return self.filter(is_accepted=True)
+
+    def overlapping(self, start_time, end_time):
+        return self.filter(rent_start_time__lt=end_time, rent_end_time__gt=start_time)
+
+    def answer(self, user, answers):
+        # answers maps request ids to 'yes' or 'no'. Returns the requests answered 'yes' that had to be
+        # rejected because their car is already booked in the requested time. Inside answer_requests_view
+        # the write transaction is already open, so no savepoint is taken: any error rolls the whole batch back.
+        with transaction.atomic(savepoint=False):
+            rent_requests = list(self.filter(id__in=list(answers), has_result=False)
+                                 .select_related('requester__staff').order_by('rent_start_time', 'id'))
+            cars = Car.objects.select_for_update().in_bulk({r.car_id for r in rent_requests if r.car_id})
+            bookings = defaultdict(list)
+            wanted = [r for r in rent_requests if answers[r.id] == 'yes' and r.car_id]
+            if wanted:
+                start_time = min(r.rent_start_time for r in wanted)
+                end_time = max(r.rent_end_time for r in wanted)
+                accepted = RentRequest.objects.filter(car_id__in=cars).accepted().overlapping(start_time, end_time)
+                for car_id, booking_start, booking_end in accepted.values_list('car_id', 'rent_start_time',
+                                                                               'rent_end_time'):
+                    bookings[car_id].append((booking_start, booking_end))
+                for car in cars.values():
+                    if car.renter_id:
+                        bookings[car.id].append((car.rent_start_time, car.rent_end_time))
+
+            now = timezone.now()
+            rejected = []
+            changed_cars = {}
+            credit_transactions = []
+            for rent_request in rent_requests:
+                car = cars.get(rent_request.car_id)
+                rent_request.car = car
+                rent_request.has_result = True
+                rent_request.is_accepted = False
+                rent_request.responser = user.staff
+                if car is None:
+                    continue
+                rent_request.price = rent_request.get_price()
+                if answers[rent_request.id] != 'yes':
+                    continue
+                start_time, end_time = rent_request.rent_start_time, rent_request.rent_end_time
+                if any(s < end_time and e > start_time for s, e in bookings[car.id]):
+                    rejected.append(rent_request)
+                    continue
+                rent_request.is_accepted = True
+                bookings[car.id].append((start_time, end_time))
+                if car.rent_end_time <= now or start_time < car.rent_start_time:
+                    car.renter = rent_request.requester
+                    car.rent_start_time = start_time
+                    car.rent_end_time = end_time
+                    car.status = car.get_status(now)
+                    changed_cars[car.id] = car
+                credit_transactions.append(
+                    rent_request.requester.credit_transaction(-rent_request.price, 'RENT', rent_request))
+                if car.owner_id:
+                    credit_transactions.append(CreditTransaction(exhibition_id=car.owner_id, amount=rent_request.price,
+                                                                 reason='RENT', rent_request=rent_request))
+
+            RentRequest.objects.bulk_update(rent_requests, ['is_accepted', 'has_result', 'responser', 'price'])
+            answered = defaultdict(list)
+            for rent_request in rent_requests:
+                publish(user_channel(rent_request.requester_id), 'answered', {
+                    'id': rent_request.id, 'accepted': rent_request.is_accepted,
+                    'car': rent_request.car.car_type if rent_request.car else None})
+                if rent_request.exhibition_id:
+                    answered[rent_request.exhibition_id].append(rent_request.id)
+            for exhibition_id, ids in answered.items():
+                publish(exhibition_channel(exhibition_id), 'answered', {'ids': ids})
+            add_daily_stats(get_stats_deltas((r.car_id, r.car.owner_id, r.rent_start_time, r.rent_end_time,
+                                              r.is_accepted, r.price) for r in rent_requests if r.car))
+            Car.objects.bulk_update(changed_cars.values(), ['renter', 'rent_start_time', 'rent_end_time', 'status'])
+            apply_credit_transactions(credit_transactions)
+            if any(rent_request.is_accepted for rent_request in rent_requests):
+                advance_availability_epoch()
+        return rejected
+
+
 class RentRequest(models.Model):
     price = models.IntegerField(default=0)
     is_accepted = models.BooleanField(default=False)
@@ -119,35 +394,271 @@ class RentRequest(models.Model):
     rent_end_time = models.DateTimeField('End Time', default=get_tomorrow)
     creation_time = models.DateTimeField('Request time:', default=timezone.now)
     responser = models.ForeignKey(Staff, on_delete=models.SET_NULL, default=None, null=True)
+    # Owner of the car when the request was made, so the queue of an exhibition needs no join.
+    exhibition = models.ForeignKey(Exhibition, on_delete=models.SET_NULL, null=True, editable=False)
+    objects = RentRequestQuerySet.as_manager()
 
     class Meta:
         permissions = (('can_answer_request', 'Can answer requests'),)
+        indexes = [
+            models.Index(fields=['requester', 'car'], name='rentrequest_customer_idx'),
+            models.Index(fields=['car', 'has_result', 'rent_start_time'], name='rentrequest_queue_idx'),
+            models.Index(fields=['requester', 'rent_start_time'], name='rentrequest_renter_idx'),
+            models.Index(fields=['car', 'rent_start_time', 'rent_end_time'], condition=Q(is_accepted=True),
+                         name='rentrequest_accepted_idx'),
+            models.Index(fields=['exhibition', 'rent_start_time', 'id'], condition=Q(has_result=False),
+                         name='rentrequest_pending_idx'),
+            # Bookings in time order, read by catalog.get_next_change.
+            models.Index(fields=['rent_start_time'], condition=Q(is_accepted=True),
+                         name='rentrequest_booking_start_idx'),
+            models.Index(fields=['rent_end_time'], condition=Q(is_accepted=True), name='rentrequest_booking_end_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        if is_new and self.car_id and not self.exhibition_id:
+            self.exhibition_id = self.car.owner_id
+        super(RentRequest, self).save(*args, **kwargs)
+        if is_new and self.car_id:
+            Car.objects.filter(pk=self.car_id).update(request_count=F('request_count') + 1)
+            cache.delete(Exhibition.customers_cache_key(self.car.owner_id))
+            if self.exhibition_id:
+                publish(exhibition_channel(self.exhibition_id), 'new_request', {'id': self.id})
 
     def accept(self, user):
-        self.is_accepted = True
-        self.has_result = True
-        self.responser = user.staff
-        self.price = self.get_price()
-        self.save()
-        car = self.car
-        car.renter = self.requester
-        car.rent_end_time = self.rent_end_time
-        car.rent_start_time = self.rent_start_time
-        car.save()
-        self.requester.change_credit(-self.price)
-        car.owner.change_credit(self.price)
+        rejected = RentRequest.objects.filter(pk=self.pk).answer(user, {self.pk: 'yes'})
+        self.refresh_from_db()
+        return not rejected
 
     def reject(self, user):
-        self.is_accepted = False
-        self.has_result = True
-        self.responser = user.staff
-        self.price = self.get_price()
-        self.save()
+        RentRequest.objects.filter(pk=self.pk).answer(user, {self.pk: 'no'})
+        self.refresh_from_db()
 
     def get_price(self):
         if self.price == 0:
-            delta_time = self.rent_end_time - self.rent_start_time
-            delta_hours = delta_time.days * 24 + ceil(delta_time.seconds/3600)
-            return delta_hours * self.car.price_per_hour
+            return self.get_hours() * self.car.price_per_hour
         else:
             return self.price
+
+    def get_hours(self):
+        return get_rent_hours(self.rent_start_time, self.rent_end_time)
+
+
+class AccountQuerySet(models.QuerySet):
+
+    def for_account(self, account):
+        if isinstance(account, Exhibition):
+            return self.filter(exhibition=account)
+        return self.filter(user=account)
+
+
+class CreditTransactionQuerySet(AccountQuerySet):
+
+    def history(self, account, before=None, limit=20):
+        queryset = self.for_account(account).order_by('-id')
+        if before:
+            queryset = queryset.filter(id__lt=before)
+        return list(queryset[:limit])
+
+    def balance(self, account):
+        snapshot = CreditSnapshot.objects.for_account(account).order_by('-last_transaction_id').first()
+        balance, last_transaction_id = (snapshot.balance, snapshot.last_transaction_id) if snapshot else (0, 0)
+        tail = self.for_account(account).filter(id__gt=last_transaction_id).aggregate(total=Sum('amount'))
+        return balance + (tail['total'] or 0)
+
+
+class CreditTransaction(models.Model):
+    REASON_CHOICES = [('TOP_UP', 'Credit change'), ('RENT', 'Rent'), ('REPAIR', 'Repair')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='credit_transactions')
+    exhibition = models.ForeignKey(Exhibition, on_delete=models.CASCADE, null=True,
+                                   related_name='credit_transactions')
+    amount = models.IntegerField()
+    reason = models.CharField(max_length=10, choices=REASON_CHOICES, default='TOP_UP')
+    rent_request = models.ForeignKey(RentRequest, on_delete=models.SET_NULL, null=True, default=None)
+    creation_time = models.DateTimeField('Time', default=timezone.now)
+    objects = CreditTransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='credittransaction_user_idx'),
+            models.Index(fields=['exhibition', 'id'], name='credittransaction_ex_idx'),
+        ]
+
+
+class CreditSnapshot(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='credit_snapshots')
+    exhibition = models.ForeignKey(Exhibition, on_delete=models.CASCADE, null=True, related_name='credit_snapshots')
+    balance = models.IntegerField()
+    last_transaction_id = models.BigIntegerField(default=0)
+    creation_time = models.DateTimeField(default=timezone.now)
+    objects = AccountQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'last_transaction_id'], name='creditsnapshot_user_idx'),
+            models.Index(fields=['exhibition', 'last_transaction_id'], name='creditsnapshot_ex_idx'),
+        ]
+
+
+def add_credits(model, deltas):
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if deltas:
+        whens = [When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()]
+        model.objects.filter(pk__in=deltas).update(credit=F('credit') + Case(*whens, default=Value(0)))
+
+
+def apply_credit_transactions(credit_transactions):
+    credit_transactions = [t for t in credit_transactions if t.amount]
+    user_credits = defaultdict(int)
+    exhibition_credits = defaultdict(int)
+    for credit_transaction in credit_transactions:
+        if credit_transaction.user_id:
+            user_credits[credit_transaction.user_id] += credit_transaction.amount
+        else:
+            exhibition_credits[credit_transaction.exhibition_id] += credit_transaction.amount
+    with transaction.atomic():
+        CreditTransaction.objects.bulk_create(credit_transactions)
+        add_credits(User, user_credits)
+        add_credits(Exhibition, exhibition_credits)
+
+
+@write_transaction
+def update_car_batch(queryset, batch_size, values):
+    car_ids = list(queryset.values_list('id', flat=True)[:batch_size])
+    return queryset.filter(id__in=car_ids).update(**values) if car_ids else 0
+
+
+def sweep_rentals(now=None, batch_size=None):
+    # Expired rentals move on to the next accepted booking of their car if there is one, then every car whose
+    # rent window no longer matches its status is moved between rented and free, batch_size cars per transaction.
+    now = now or timezone.now()
+    batch_size = batch_size or getattr(settings, 'RENTAL_SWEEP_BATCH_SIZE', 500)
+    next_bookings = RentRequest.objects.filter(car=OuterRef('pk'), rent_end_time__gt=now).accepted() \
+        .order_by('rent_start_time')
+    transitions = [
+        ('rolled', Car.objects.filter(renter__isnull=False, rent_end_time__lte=now).filter(Exists(next_bookings)),
+         {'renter': Subquery(next_bookings.values('requester')[:1]),
+          'rent_start_time': Subquery(next_bookings.values('rent_start_time')[:1]),
+          'rent_end_time': Subquery(next_bookings.values('rent_end_time')[:1])}),
+        ('ended', Car.objects.filter(Q(rent_end_time__lte=now) | Q(rent_start_time__gt=now), status=Car.RENTED),
+         {'status': Car.FREE}),
+        ('started', Car.objects.filter(status=Car.FREE, renter__isnull=False, rent_start_time__lte=now,
+                                       rent_end_time__gt=now), {'status': Car.RENTED}),
+    ]
+    counts = {}
+    for name, queryset, values in transitions:
+        counts[name] = 0
+        while True:
+            updated = update_car_batch(queryset, batch_size, dict(values, updated_at=now))
+            counts[name] += updated
+            if updated < batch_size:
+                break
+    return counts
+
+
+class DailyStats(models.Model):
+    day = models.DateField()
+    revenue = models.BigIntegerField(default=0)
+    rented_hours = models.PositiveIntegerField(default=0)
+    requests = models.PositiveIntegerField(default=0)
+    rejections = models.PositiveIntegerField(default=0)
+
+    FIELDS = ('revenue', 'rented_hours', 'requests', 'rejections')
+
+    class Meta:
+        abstract = True
+
+
+class DailyExhibitionStats(DailyStats):
+    exhibition = models.ForeignKey(Exhibition, on_delete=models.CASCADE, related_name='daily_stats')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['exhibition', 'day'], name='daily_exhibition_stats_unique')]
+
+
+class DailyCarStats(DailyStats):
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name='daily_stats')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['car', 'day'], name='daily_car_stats_unique')]
+
+
+def split_by_day(start_time, end_time):
+    # Yields (local day, seconds of the rental on that day) for every day the rental covers.
+    day = timezone.localdate(start_time)
+    while True:
+        next_day = day + datetime.timedelta(days=1)
+        day_end = min(end_time, timezone.make_aware(datetime.datetime.combine(next_day, datetime.time.min)))
+        yield day, max((day_end - start_time).total_seconds(), 0)
+        if day_end >= end_time:
+            return
+        start_time, day = day_end, next_day
+
+
+def get_stats_deltas(answered_requests):
+    # answered_requests yields (car_id, exhibition_id, rent_start_time, rent_end_time, is_accepted, price).
+    # Requests and rejections are counted on the local day the rental starts, rented hours and revenue are
+    # shared out over the days it covers, rounded so the days add up to the whole rental.
+    deltas = {DailyExhibitionStats: defaultdict(lambda: defaultdict(int)),
+              DailyCarStats: defaultdict(lambda: defaultdict(int))}
+    for car_id, exhibition_id, start_time, end_time, is_accepted, price in answered_requests:
+        keys = [(DailyCarStats, car_id)]
+        if exhibition_id:
+            keys.append((DailyExhibitionStats, exhibition_id))
+        for model, key in keys:
+            delta = deltas[model][key, timezone.localdate(start_time)]
+            delta['requests'] += 1
+            if not is_accepted:
+                delta['rejections'] += 1
+        if not is_accepted:
+            continue
+        total = (end_time - start_time).total_seconds()
+        elapsed = hours = revenue = 0
+        for day, seconds in split_by_day(start_time, end_time):
+            elapsed += seconds
+            day_hours = round(elapsed / 3600) - hours
+            day_revenue = (round(price * elapsed / total) if total else price) - revenue
+            hours += day_hours
+            revenue += day_revenue
+            if day_hours or day_revenue:
+                for model, key in keys:
+                    delta = deltas[model][key, day]
+                    delta['rented_hours'] += day_hours
+                    delta['revenue'] += day_revenue
+    return deltas
+
+
+def add_daily_stats(deltas):
+    with transaction.atomic():
+        for model, model_deltas in deltas.items():
+            if not model_deltas:
+                continue
+            key_field = 'car_id' if model is DailyCarStats else 'exhibition_id'
+            model.objects.bulk_create([model(**{key_field: key, 'day': day}) for key, day in model_deltas],
+                                      ignore_conflicts=True)
+            rows = model.objects.select_for_update().filter(**{key_field + '__in': {key for key, day in model_deltas},
+                                                               'day__in': {day for key, day in model_deltas}})
+            changed = []
+            for row in rows:
+                delta = model_deltas.get((getattr(row, key_field), row.day))
+                if delta:
+                    for field, value in delta.items():
+                        setattr(row, field, getattr(row, field) + value)
+                    changed.append(row)
+            model.objects.bulk_update(changed, DailyStats.FIELDS)
+
+
+def rebuild_daily_stats():
+    answered = RentRequest.objects.filter(has_result=True, car__isnull=False) \
+        .values_list('car_id', 'car__owner_id', 'rent_start_time', 'rent_end_time', 'is_accepted', 'price')
+    deltas = get_stats_deltas(answered.iterator(chunk_size=2000))
+    with transaction.atomic():
+        counts = {}
+        for model, model_deltas in deltas.items():
+            key_field = 'car_id' if model is DailyCarStats else 'exhibition_id'
+            model.objects.all().delete()
+            model.objects.bulk_create((model(**{key_field: key, 'day': day}, **delta)
+                                       for (key, day), delta in model_deltas.items()), batch_size=1000)
+            counts[model] = len(model_deltas)
+    return counts
@@ -0,0 +1,127 @@
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.db import connection
+
+PLACEHOLDER_LIST = re.compile(r'%s(, %s)+')
+
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def get_shape(sql):
+    return PLACEHOLDER_LIST.sub('%s, ...', sql)
+
+
+class QueryRecorder:
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for sql, duration in self.queries)
+
+    def repeated_shapes(self):
+        shapes = Counter(get_shape(sql) for sql, duration in self.queries)
+        return {shape: count for shape, count in shapes.items() if count > 1}
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every connection. sync_to_async copies the context into its worker threads, so the
+    # queries an async view runs there reach the recorder of its request too.
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class QueryStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view_name, recorder):
+        repeated_shapes = recorder.repeated_shapes()
+        with self.lock:
+            view = self.views.setdefault(view_name, {'requests': 0, 'queries': 0, 'max_queries': 0,
+                                                     'sql_time': 0.0, 'repeated_shapes': Counter()})
+            view['requests'] += 1
+            view['queries'] += recorder.count
+            view['max_queries'] = max(view['max_queries'], recorder.count)
+            view['sql_time'] += recorder.total_time
+            for shape, count in repeated_shapes.items():
+                view['repeated_shapes'][shape] = max(view['repeated_shapes'][shape], count)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                view_name: {
+                    'requests': view['requests'],
+                    'avg_queries': view['queries'] / view['requests'],
+                    'max_queries': view['max_queries'],
+                    'avg_sql_ms': view['sql_time'] * 1000 / view['requests'],
+                    'repeated_shapes': dict(view['repeated_shapes'].most_common(10)),
+                }
+                for view_name, view in self.views.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+
+query_stats = QueryStats()
+
+
+class QueryBudgetMixin:
+
+    def assertQueryBudget(self, max_queries, max_repeats=None):
+        return QueryBudget(self, max_queries, max_repeats)
+
+
+class QueryBudget:
+
+    def __init__(self, test_case, max_queries, max_repeats):
+        self.test_case = test_case
+        self.max_queries = max_queries
+        self.max_repeats = max_repeats
+        self.recorder = QueryRecorder()
+        self.wrapper = None
+
+    def __enter__(self):
+        self.wrapper = connection.execute_wrapper(self.recorder)
+        self.wrapper.__enter__()
+        return self.recorder
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wrapper.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        queries = '\n'.join(sql for sql, duration in self.recorder.queries)
+        self.test_case.assertLessEqual(self.recorder.count, self.max_queries,
+                                       '%d queries executed, budget is %d:\n%s'
+                                       % (self.recorder.count, self.max_queries, queries))
+        if self.max_repeats is not None:
+            for shape, count in self.recorder.repeated_shapes().items():
+                self.test_case.assertLessEqual(count, self.max_repeats,
+                                               'Query repeated %d times:\n%s' % (count, shape))
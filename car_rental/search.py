@@ -0,0 +1,94 @@
+import re
+
+from django.db import connections
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+FTS_TABLE = 'car_rental_car_fts'
+MAX_TERMS = 8
+CHUNK_SIZE = 500
+
+_fts_tables = {}
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def fts_available(using='default'):
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_tables:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts_tables[name] = cursor.fetchone() is not None
+    return _fts_tables[name]
+
+
+def get_tokens(*values):
+    tokens = []
+    for value in values:
+        for token in tokenize(value):
+            token = token[:50]
+            if token not in tokens:
+                tokens.append(token)
+    return tokens
+
+
+def index_cars(car_ids, using='default'):
+    from .models import Car, CarSearchToken
+
+    car_ids = list(car_ids)
+    for start in range(0, len(car_ids), CHUNK_SIZE):
+        chunk = car_ids[start:start + CHUNK_SIZE]
+        rows = list(Car.objects.using(using).filter(id__in=chunk).values_list('id', 'car_type', 'plate', 'owner__name'))
+        unindex_cars(chunk, using)
+        if fts_available(using):
+            with connections[using].cursor() as cursor:
+                cursor.executemany('INSERT INTO %s (rowid, car_type, plate, owner_name) VALUES (%%s, %%s, %%s, %%s)'
+                                   % FTS_TABLE, [(car_id, car_type, plate, owner_name or '')
+                                                 for car_id, car_type, plate, owner_name in rows])
+        else:
+            CarSearchToken.objects.using(using).bulk_create(
+                CarSearchToken(car_id=car_id, token=token)
+                for car_id, car_type, plate, owner_name in rows for token in get_tokens(car_type, plate, owner_name))
+
+
+def unindex_cars(car_ids, using='default'):
+    from .models import CarSearchToken
+
+    car_ids = list(car_ids)
+    if not car_ids:
+        return
+    if fts_available(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (FTS_TABLE, ', '.join(['%s'] * len(car_ids))),
+                           car_ids)
+    else:
+        CarSearchToken.objects.using(using).filter(car_id__in=car_ids).delete()
+
+
+def search_cars(queryset, text):
+    from .models import CarSearchToken
+
+    terms = tokenize(text)[:MAX_TERMS]
+    if not terms:
+        return queryset
+    if fts_available(queryset.db):
+        # One MATCH joined on rowid, so the index is read once and bm25 comes with every hit.
+        expression = ' '.join('"%s"*' % term for term in terms)
+        queryset = queryset.extra(select={'search_rank': 'bm25(%s)' % FTS_TABLE}, tables=[FTS_TABLE],
+                                  where=['%s MATCH %%s' % FTS_TABLE,
+                                         '%s.rowid = %s.id' % (FTS_TABLE, queryset.model._meta.db_table)],
+                                  params=[expression])
+    else:
+        tokens = CarSearchToken.objects.using(queryset.db)
+        for term in terms:
+            queryset = queryset.filter(id__in=tokens.filter(token__gte=term, token__lt=term + '\uffff')
+                                       .values('car_id'))
+        exact_hits = tokens.filter(car=OuterRef('pk'), token__in=terms).order_by().values('car') \
+            .annotate(hits=Count('id')).values('hits')
+        queryset = queryset.annotate(search_rank=-Coalesce(Subquery(exact_hits), Value(0)))
+    return queryset.order_by('search_rank', 'id')
@@ -0,0 +1,98 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .actors import invalidate_actor
+from .catalog import advance_availability_epoch
+from .fragments import delete_car_fragments
+from .models import Car, Exhibition, Staff, User
+from .query_stats import install_query_recorder
+from .search import index_cars, unindex_cars
+
+connection_created.connect(install_query_recorder)
+
+
+def get_search_values(car):
+    return car.__dict__.get('car_type'), car.__dict__.get('plate'), car.__dict__.get('owner_id')
+
+
+@receiver(post_init, sender=Car)
+def remember_car_search_values(sender, instance, **kwargs):
+    instance._search_values = get_search_values(instance)
+
+
+@receiver(post_save, sender=Car)
+def index_car(sender, instance, created, using, **kwargs):
+    values = get_search_values(instance)
+    if created or values != instance._search_values:
+        index_cars([instance.id], using)
+        instance._search_values = values
+
+
+@receiver(post_delete, sender=Car)
+def unindex_car(sender, instance, using, **kwargs):
+    unindex_cars([instance.id], using)
+
+
+@receiver(post_save, sender=Car)
+@receiver(post_delete, sender=Car)
+def car_availability_changed(sender, **kwargs):
+    advance_availability_epoch()
+
+
+@receiver(post_init, sender=Car)
+def remember_car_stamp(sender, instance, **kwargs):
+    instance._fragment_stamp = instance.__dict__.get('updated_at')
+
+
+@receiver(post_save, sender=Car)
+def forget_old_car_fragments(sender, instance, created, **kwargs):
+    if not created and instance._fragment_stamp != instance.updated_at:
+        delete_car_fragments(instance.id, instance._fragment_stamp)
+    instance._fragment_stamp = instance.updated_at
+
+
+@receiver(post_delete, sender=Car)
+def forget_car_fragments(sender, instance, **kwargs):
+    delete_car_fragments(instance.id, instance.__dict__.get('updated_at'))
+
+
+@receiver(post_init, sender=Exhibition)
+def remember_exhibition_name(sender, instance, **kwargs):
+    instance._search_name = instance.__dict__.get('name')
+
+
+@receiver(post_save, sender=Exhibition)
+def index_exhibition_cars(sender, instance, created, using, **kwargs):
+    if not created and instance.name != instance._search_name:
+        index_cars(instance.cars_owned.values_list('id', flat=True), using)
+        instance.cars_owned.update(updated_at=timezone.now())
+        advance_availability_epoch()
+    instance._search_name = instance.name
+
+
+@receiver(post_save, sender=User)
+def forget_user_actor(sender, instance, created, update_fields, **kwargs):
+    # Cached permissions depend on is_active and is_superuser, a login or a credit change leaves them alone.
+    if not created and (update_fields is None or update_fields & {'is_active', 'is_superuser'}):
+        invalidate_actor(instance.pk)
+
+
+@receiver(post_save, sender=Staff)
+@receiver(post_delete, sender=Staff)
+def forget_actor(sender, instance, **kwargs):
+    invalidate_actor(instance.user_id)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def forget_actor_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_actor(instance.pk)
+    elif action == 'pre_clear':
+        # A permission or group losing every user, which are only known before the rows go.
+        invalidate_actor(*instance.user_set.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_actor(*pk_set)
@@ -6,20 +6,20 @@ from car_rental.models import Car, RentRequest, Staff
 
 
 class CarStaffTable(tables.Table):
+    selection = tables.CheckBoxColumn(accessor='pk', attrs={'input': {'form': 'bulk-form'}})
     car_type = tables.Column()
-    rent_end_time = tables.Column(verbose_name='Status')
+    status = tables.Column(verbose_name='Status')
 
     def render_car_type(self, value, record):
         return format_html("<a href=\"{0}\">{1}</a>", reverse('car_rental:car', kwargs={'pk': record.id}), value)
 
-    def render_rent_end_time(self, value, record):
-        status = 'free' if not record.is_rented() else 'rented'
-        color = 'darkgreen' if not record.is_rented() else 'darkred'
-        return format_html("<span style=\"color: " + color + "\">" + status + "</span>")
+    def render_status(self, value, record):
+        color = {Car.FREE: 'darkgreen', Car.RENTED: 'darkred'}.get(record.status, 'darkorange')
+        return format_html("<span style=\"color: " + color + "\">{0}</span>", value)
 
     class Meta:
         model = Car
-        fields = ['car_type', 'plate']
+        fields = ['selection', 'car_type', 'plate', 'status']
         template_name = 'django_tables2/bootstrap-responsive.html'
 
 
@@ -1,11 +1,43 @@
+import asyncio
+import csv
 import datetime
-
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
 from django.contrib.auth.models import Permission
-from django.test import TestCase
-from django.urls import reverse
+from django.core import signals
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, connection, connections
+from django.db.utils import load_backend
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
 from django.utils import timezone
+from PIL import Image
 
-from car_rental.models import User, Car, RentRequest, Staff, Exhibition
+from car_rental.actors import actor_cache_key, get_actor
+from car_rental.async_views import event_stream, get_event_channels, route_events
+from car_rental.events import Broker, exhibition_channel, get_broker, user_channel
+from car_rental.imports import ArchiveImages, import_cars, import_staff, read_car_rows
+from car_rental.catalog import get_catalog_timeout
+from car_rental.fragments import get_car_fragment_keys
+from car_rental.transactions import write_transaction
+from car_rental.search import index_cars, search_cars
+from car_rental.query_stats import QueryBudgetMixin, QueryRecorder, query_stats
+from car_rental.models import User, Car, RentRequest, Staff, Exhibition, CreditTransaction, CreditSnapshot, \
+    CarSearchToken, DailyCarStats, DailyExhibitionStats, sweep_rentals
 
 
 def create_exhibition(name='ex1'):
@@ -138,6 +170,58 @@ class CarListStaffViewTest(TestCase):
         self.assertContains(response, 'Status')
 
 
+class CarStatusTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_status_follows_accept_and_repair(self):
+        staff_user = create_user(is_staff=True)
+        car = create_car(owner=staff_user.staff.exhibition)
+        self.assertEqual(car.status, Car.FREE)
+        now = timezone.now()
+        create_request(create_user(), car, now - datetime.timedelta(hours=1), now + datetime.timedelta(hours=1)) \
+            .accept(staff_user)
+        car.refresh_from_db()
+        self.assertEqual(car.status, Car.RENTED)
+        car.needs_repair = True
+        car.save(update_fields=['needs_repair'])
+        self.assertEqual(Car.objects.get().status, Car.NEEDS_REPAIR)
+        Car.objects.all().set_needs_repair(False)
+        self.assertEqual(Car.objects.get().status, Car.RENTED)
+
+    def test_sweep_rentals(self):
+        staff_user = create_user(is_staff=True)
+        now = timezone.now()
+        expired, rolling, starting = [create_rented_car(renter=create_user(), owner=staff_user.staff.exhibition)
+                                      for i in range(3)]
+        next_renter = create_user()
+        next_request = create_request(next_renter, rolling, now + datetime.timedelta(days=2),
+                                      now + datetime.timedelta(days=3))
+        next_request.accept(staff_user)
+        Car.objects.filter(id__in=[expired.id, rolling.id]).update(rent_end_time=now - datetime.timedelta(minutes=1))
+        Car.objects.filter(id=starting.id).update(status=Car.FREE)
+        counts = sweep_rentals(now + datetime.timedelta(seconds=1), batch_size=1)
+        self.assertEqual(counts, {'rolled': 1, 'ended': 2, 'started': 1})
+        statuses = dict(Car.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[car.id] for car in (expired, rolling, starting)], [Car.FREE, Car.FREE, Car.RENTED])
+        rolling.refresh_from_db()
+        self.assertEqual((rolling.renter, rolling.rent_start_time), (next_renter, next_request.rent_start_time))
+        out = StringIO()
+        call_command('sweep_rentals', stdout=out)
+        self.assertIn('0 rentals started, 0 ended', out.getvalue())
+
+    def test_staff_table_status_filter(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        exhibition = staff_user.staff.exhibition
+        free_car = create_car('free car', owner=exhibition)
+        rented_car = create_rented_car('rented car', owner=exhibition)
+        response = self.client.get(reverse('car_rental:cars_staff'), {'status': Car.RENTED})
+        self.assertEqual(list(response.context['cars']), [rented_car])
+        response = self.client.get(reverse('car_rental:cars_staff'), {'ordering': '-status'})
+        self.assertEqual(list(response.context['cars']), [rented_car, free_car])
+
+
 class CarListRenterViewTest(TestCase):
     def test_rented_car(self):
         car = create_rented_car()
@@ -162,6 +246,181 @@ class CarListRenterViewTest(TestCase):
         self.assertNotContains(response, "There are no available cars for you!")
         self.assertContains(response, car.car_type)
 
+    def test_car_with_future_booking(self):
+        renter = login_a_user(self.client)
+        car = create_car()
+        start_time = timezone.now() + datetime.timedelta(days=30)
+        rent_request = create_request(renter, car, start_time, start_time + datetime.timedelta(days=2))
+        rent_request.is_accepted = True
+        rent_request.save()
+        response = self.client.get(reverse('car_rental:cars'))
+        self.assertContains(response, car.car_type)
+        data = {'available_from': start_time + datetime.timedelta(days=1),
+                'available_until': start_time + datetime.timedelta(days=5)}
+        response = self.client.get(reverse('car_rental:cars'), data)
+        self.assertNotContains(response, car.car_type)
+        data = {'available_from': start_time + datetime.timedelta(days=2),
+                'available_until': start_time + datetime.timedelta(days=5)}
+        response = self.client.get(reverse('car_rental:cars'), data)
+        self.assertContains(response, car.car_type)
+
+
+class CarPopularityTest(TestCase):
+
+    def test_request_count_increases(self):
+        car = create_car()
+        requester = create_user('user1')
+        create_request(requester, car)
+        create_request(requester, car)
+        car.refresh_from_db()
+        self.assertEqual(car.request_count, 2)
+
+    def test_popular_filter(self):
+        login_a_user(self.client)
+        requester = create_user('user1')
+        popular_car = create_car(car_type='popular_type')
+        create_car(car_type='quiet_type')
+        for i in range(3):
+            create_request(requester, popular_car)
+        response = self.client.get(reverse('car_rental:cars'), {'popular': 'P'})
+        self.assertContains(response, 'popular_type')
+        self.assertNotContains(response, 'quiet_type')
+
+    @override_settings(POPULAR_CAR_REQUEST_COUNT=1)
+    def test_popular_threshold_setting(self):
+        create_request(create_user('user1'), create_car(car_type='popular_type'))
+        self.assertEqual(Car.objects.popular().count(), 1)
+
+    def test_sort_by_popularity(self):
+        login_a_user(self.client)
+        requester = create_user('user1')
+        create_car(car_type='quiet_type')
+        popular_car = create_car(car_type='popular_type')
+        create_request(requester, popular_car)
+        response = self.client.get(reverse('car_rental:cars'), {'ordering': '-popularity'})
+        content = response.content.decode()
+        self.assertLess(content.index('popular_type'), content.index('quiet_type'))
+
+
+class CarSearchTest(TestCase):
+
+    def search(self, text):
+        response = self.client.get(reverse('car_rental:cars'), {'car_type': text})
+        return [car.id for car in response.context['cars']]
+
+    def test_prefix_search(self):
+        login_a_user(self.client)
+        pride = create_car(car_type='Pride 131')
+        peugeot = create_car(car_type='Peugeot 206')
+        peugeot.owner.name = 'Tehran Cars'
+        peugeot.owner.save()
+        peugeot.plate = '22B33344'
+        peugeot.save()
+        self.assertEqual(self.search('pri'), [pride.id])
+        self.assertEqual(self.search('22b'), [peugeot.id])
+        self.assertEqual(self.search('tehran peu'), [peugeot.id])
+        self.assertEqual(self.search('tehran pri'), [])
+
+    def test_index_follows_changes(self):
+        login_a_user(self.client)
+        car = create_car(car_type='Pride')
+        car.owner.name = 'Shiraz Rental'
+        car.owner.save()
+        self.assertEqual(self.search('shiraz'), [car.id])
+        car.car_type = 'Samand'
+        car.save()
+        self.assertEqual(self.search('pride'), [])
+        self.assertEqual(self.search('sam'), [car.id])
+        car.delete()
+        self.assertEqual(self.search('sam'), [])
+
+    def test_token_fallback(self):
+        tiba = create_car(car_type='Tiba')
+        tibax = create_car(car_type='Tibax tiba2')
+        with mock.patch('car_rental.search.fts_available', return_value=False):
+            index_cars([tiba.id, tibax.id])
+            self.assertEqual([car.id for car in search_cars(Car.objects.all(), 'tiba')], [tiba.id, tibax.id])
+            self.assertEqual([car.id for car in search_cars(Car.objects.all(), 'tibax')], [tibax.id])
+        self.assertEqual(CarSearchToken.objects.filter(car=tibax).count(), 4)
+
+
+class FragmentCacheTest(TestCase):
+
+    def setUp(self):
+        caches['fragments'].clear()
+
+    def test_catalog_renders_from_cache(self):
+        login_a_user(self.client)
+        owner = create_car().owner
+        Car.objects.bulk_create(Car(owner=owner, car_type='bulk', price_per_hour=10) for i in range(99))
+        self.client.get(reverse('car_rental:cars'))
+        Car.objects.update(price_per_hour=77)
+        changed = Car.objects.first()
+        changed.price_per_hour = 55
+        changed.save()
+        response = self.client.get(reverse('car_rental:cars'))
+        self.assertContains(response, 'Price per hour: 10', count=99)
+        self.assertContains(response, 'Price per hour: 55', count=1)
+
+    def test_exhibition_rename_refreshes_cards(self):
+        login_a_user(self.client)
+        car = create_car()
+        self.client.get(reverse('car_rental:cars'))
+        car.owner.name = 'Renamed'
+        car.owner.save()
+        self.assertContains(self.client.get(reverse('car_rental:cars')), 'Owner: Renamed')
+
+    def test_detail_fragments_deleted_with_car(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        car = create_car(owner=staff_user.staff.exhibition)
+        response = self.client.get(reverse('car_rental:car', kwargs={'pk': car.id}))
+        self.assertContains(response, 'Status')
+        self.assertNotContains(response, 'Exhibition')
+        keys = get_car_fragment_keys(car.id, car.updated_at)
+        self.assertEqual(len(caches['fragments'].get_many(keys)), 2)
+        car.delete()
+        self.assertEqual(caches['fragments'].get_many(keys), {})
+
+
+class CatalogCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def get_catalog_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('car_rental:cars'), params)
+        return response, [query['sql'] for query in queries if 'car_rental_car' in query['sql']]
+
+    def test_repeated_catalog_skips_database(self):
+        login_a_user(self.client)
+        create_car()
+        response, queries = self.get_catalog_queries()
+        self.assertTrue(queries)
+        response, queries = self.get_catalog_queries()
+        self.assertEqual(queries, [])
+        self.assertEqual(len(response.context['cars']), 1)
+        response, queries = self.get_catalog_queries(car_type='type')
+        self.assertTrue(queries)
+
+    def test_accept_advances_epoch(self):
+        renter = login_a_user(self.client)
+        staff_user = create_user(is_staff=True)
+        car = create_car(owner=staff_user.staff.exhibition)
+        self.assertEqual(len(self.get_catalog_queries()[0].context['cars']), 1)
+        self.assertTrue(create_request(renter, car).accept(staff_user))
+        self.assertEqual(len(self.get_catalog_queries()[0].context['cars']), 0)
+
+    def test_timeout_ends_with_rental(self):
+        car = create_rented_car()
+        now = timezone.now()
+        car.rent_end_time = now + datetime.timedelta(seconds=30)
+        car.save()
+        self.assertEqual(get_catalog_timeout(now), 30)
+        car.rent_end_time = now + datetime.timedelta(days=1)
+        car.save()
+        self.assertEqual(get_catalog_timeout(now), 60)
+
 
 class CarDetailTest(TestCase):
 
@@ -400,6 +659,98 @@ class RentRequestListStaffViewTest(TestCase):
         self.assertContains(response, "No Requests")
         self.assertNotContains(response, car.car_type)
 
+    def test_queue_pages(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        car = create_car(owner=staff_user.staff.exhibition)
+        start_time = timezone.now()
+        for i in range(25):
+            create_request(create_user(), car, start_time=start_time + datetime.timedelta(hours=i % 5))
+        url = reverse('car_rental:requests_staff')
+        response = self.client.get(url)
+        first_page = [rent_request.id for rent_request in response.context['requests']]
+        self.assertEqual(len(first_page), 20)
+        next_url = response.context['keyset_page']['next_url']
+        response = self.client.get(url + next_url)
+        second_page = [rent_request.id for rent_request in response.context['requests']]
+        self.assertEqual(len(second_page), 5)
+        self.assertFalse(set(first_page) & set(second_page))
+        self.assertContains(response, 'action="%s%s"' % (reverse('car_rental:answer_requests'), next_url))
+        response = self.client.post(reverse('car_rental:answer_requests') + next_url, {str(second_page[0]): 'no'})
+        self.assertRedirects(response, url + next_url)
+        response = self.client.get(url + next_url)
+        self.assertEqual([rent_request.id for rent_request in response.context['requests']], second_page[1:])
+
+    def test_new_requests(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        car = create_car(owner=staff_user.staff.exhibition)
+        old_request = create_request(create_user(), car)
+        response = self.client.get(reverse('car_rental:requests_staff'))
+        since = response.context['queue_since']
+        self.assertEqual(since, old_request.id)
+        new_request = create_request(create_user('newcomer'), car)
+        answered_request = create_request(create_user(), car)
+        answered_request.has_result = True
+        answered_request.save()
+        create_request(create_user('stranger'), create_car(ex_name='ex2'))
+        response = self.client.get(reverse('car_rental:new_requests_staff'), {'since': since})
+        self.assertEqual(list(response.context['requests']), [new_request])
+        self.assertContains(response, 'data-request="%d"' % new_request.id)
+        self.assertContains(response, 'newcomer')
+        self.assertNotContains(response, 'stranger')
+        response = self.client.get(reverse('car_rental:new_requests_staff'), {'since': new_request.id})
+        self.assertNotContains(response, '<tr')
+        response = self.client.get(reverse('car_rental:new_requests_staff'), {'since': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_new_requests_access_denied(self):
+        login_a_user(self.client, is_staff=True)
+        response = self.client.get(reverse('car_rental:new_requests_staff'), {'since': 0})
+        self.assertEqual(response.status_code, 403)
+
+
+class RentRequestSubmitTest(TestCase):
+
+    def setUp(self):
+        self.staff_user = create_user(is_staff=True)
+        self.car = create_car(owner=self.staff_user.staff.exhibition)
+        self.start = (timezone.now() + datetime.timedelta(days=1)).replace(minute=0, second=0, microsecond=0)
+
+    def book(self, start_hours, end_hours):
+        create_request(create_user(), self.car, self.start + datetime.timedelta(hours=start_hours),
+                       self.start + datetime.timedelta(hours=end_hours)).accept(self.staff_user)
+
+    def submit(self, start_hours, end_hours):
+        start_time = timezone.localtime(self.start + datetime.timedelta(hours=start_hours))
+        end_time = timezone.localtime(self.start + datetime.timedelta(hours=end_hours))
+        return self.client.post(reverse('car_rental:rent_request', kwargs={'pk': self.car.id}),
+                                {'rent_start_time': start_time.strftime('%Y-%m-%d %H:%M'),
+                                 'rent_end_time': end_time.strftime('%Y-%m-%d %H:%M')}, follow=True)
+
+    def test_next_free_time(self):
+        self.book(0, 2)
+        self.book(3, 5)
+        self.book(6, 8)
+        hours = datetime.timedelta(hours=1)
+        self.assertEqual(self.car.get_next_free_time(self.start + 9 * hours, self.start + 10 * hours),
+                         self.start + 9 * hours)
+        self.assertEqual(self.car.get_next_free_time(self.start, self.start + hours), self.start + 2 * hours)
+        self.assertEqual(self.car.get_next_free_time(self.start, self.start + 2 * hours), self.start + 8 * hours)
+
+    def test_overlapping_request_rejected(self):
+        self.book(0, 2)
+        login_a_user(self.client)
+        response = self.submit(1, 3)
+        self.assertContains(response, 'This car is not free in the requested time. '
+                                      'It is next free for that length of time from')
+        self.assertEqual(RentRequest.objects.filter(has_result=False).count(), 0)
+        response = self.submit(2, 4)
+        self.assertRedirects(response, reverse('car_rental:requests_renter'))
+        response = self.submit(3, 5)
+        self.assertContains(response, 'You have already requested this car in this time.')
+        self.assertEqual(RentRequest.objects.filter(has_result=False).count(), 1)
+
 
 class AnswerRequestView(TestCase):
 
@@ -476,6 +827,175 @@ class AnswerRequestView(TestCase):
         self.assertEqual(owner.credit, 1000)
         self.assertEqual(requester.credit, -1000)
 
+    def test_overlapping_request_rejected(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        car = create_car(owner=staff_user.staff.exhibition)
+        start_time = timezone.now() + datetime.timedelta(days=10)
+        booked = create_request(create_user('user1'), car, start_time, start_time + datetime.timedelta(days=2))
+        booked.is_accepted = True
+        booked.has_result = True
+        booked.save()
+        rent_request = create_request(create_user('user2'), car, start_time + datetime.timedelta(days=1),
+                                      start_time + datetime.timedelta(days=3))
+        self.client.post(reverse('car_rental:answer_requests'), {str(rent_request.id): 'yes'})
+        rent_request.refresh_from_db()
+        self.assertTrue(rent_request.has_result)
+        self.assertFalse(rent_request.is_accepted)
+
+    def test_accept_booking_after_current_rental(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        car = create_rented_car(owner=staff_user.staff.exhibition, days=1)
+        start_time = timezone.now() + datetime.timedelta(days=2)
+        rent_request = create_request(create_user('user2'), car, start_time, start_time + datetime.timedelta(days=1))
+        self.client.post(reverse('car_rental:answer_requests'), {str(rent_request.id): 'yes'})
+        rent_request.refresh_from_db()
+        car.refresh_from_db()
+        self.assertTrue(rent_request.is_accepted)
+        self.assertTrue(car.is_rented())
+        self.assertLess(car.rent_end_time, start_time)
+
+    def test_accept_car_without_renter_ignores_its_window(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        car = create_car(owner=staff_user.staff.exhibition)
+        car.rent_end_time = timezone.now() + datetime.timedelta(days=2)
+        car.save()
+        start_time = timezone.now() + datetime.timedelta(hours=1)
+        end_time = start_time + datetime.timedelta(hours=5)
+        self.assertTrue(Car.objects.filter(id=car.id).free_between(start_time, end_time).exists())
+        rent_request = create_request(create_user('user2'), car, start_time, end_time)
+        self.client.post(reverse('car_rental:answer_requests'), {str(rent_request.id): 'yes'})
+        rent_request.refresh_from_db()
+        self.assertTrue(rent_request.is_accepted)
+
+    def test_overlapping_answers_in_one_batch(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        owner = staff_user.staff.exhibition
+        car = create_car(owner=owner)
+        start_time = timezone.now() + datetime.timedelta(hours=1)
+        first = create_request(create_user('user1'), car, start_time, start_time + datetime.timedelta(hours=5))
+        second = create_request(create_user('user2'), car, start_time + datetime.timedelta(hours=2),
+                                start_time + datetime.timedelta(hours=8))
+        response = self.client.post(reverse('car_rental:answer_requests'),
+                                    {str(first.id): 'yes', str(second.id): 'yes'}, follow=True)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        owner.refresh_from_db()
+        self.assertTrue(first.is_accepted)
+        self.assertTrue(second.has_result)
+        self.assertFalse(second.is_accepted)
+        self.assertEqual(owner.credit, first.price)
+        self.assertContains(response, 'is already rented')
+
+    def test_batch_query_count_does_not_grow(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        owner = staff_user.staff.exhibition
+        # Cache the staff row and permissions first, like every later request finds them.
+        self.client.get(reverse('car_rental:profile'))
+
+        def answer_batch(size):
+            answers = {}
+            for i in range(size):
+                car = create_car(owner=owner)
+                rent_request = create_request(create_user(), car, timezone.now() + datetime.timedelta(hours=1),
+                                              timezone.now() + datetime.timedelta(hours=3))
+                answers[str(rent_request.id)] = 'yes' if i % 2 else 'no'
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse('car_rental:answer_requests'), answers)
+            return len(queries)
+
+        self.assertEqual(answer_batch(2), answer_batch(8))
+        self.assertFalse(RentRequest.objects.filter(has_result=False).exists())
+
+
+class DailyStatsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def get_start(self, days_ago, hour):
+        day = timezone.localdate() - datetime.timedelta(days=days_ago)
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time(hour)))
+
+    def answer_requests(self, staff_user):
+        exhibition = staff_user.staff.exhibition
+        cars = [create_car('car%d' % i, owner=exhibition) for i in range(2)]
+        start = self.get_start(3, 10)
+        create_request(create_user(), cars[0], start, start + datetime.timedelta(hours=5)).accept(staff_user)
+        create_request(create_user(), cars[0], start + datetime.timedelta(hours=1),
+                       start + datetime.timedelta(hours=2)).accept(staff_user)
+        create_request(create_user(), cars[1], start, start + datetime.timedelta(hours=2)).reject(staff_user)
+        create_request(create_user(), cars[1], start - datetime.timedelta(days=1), start).accept(staff_user)
+        return cars
+
+    def get_rows(self, model):
+        return list(model.objects.order_by('day', 'id').values_list('day', 'revenue', 'rented_hours', 'requests',
+                                                                    'rejections'))
+
+    def test_rollups_updated_on_answer(self):
+        staff_user = create_user(is_staff=True)
+        cars = self.answer_requests(staff_user)
+        day = timezone.localdate() - datetime.timedelta(days=3)
+        stats = DailyExhibitionStats.objects.get(exhibition=staff_user.staff.exhibition, day=day)
+        self.assertEqual((stats.revenue, stats.rented_hours, stats.requests, stats.rejections), (150, 15, 3, 2))
+        car_stats = DailyCarStats.objects.get(car=cars[1], day=day)
+        self.assertEqual((car_stats.revenue, car_stats.requests, car_stats.rejections), (100, 1, 1))
+        stats = DailyExhibitionStats.objects.get(day=day - datetime.timedelta(days=1))
+        self.assertEqual((stats.revenue, stats.rented_hours, stats.requests), (140, 14, 1))
+
+    def test_rebuild_matches_incremental(self):
+        self.answer_requests(create_user(is_staff=True))
+        exhibition_rows = self.get_rows(DailyExhibitionStats)
+        car_rows = self.get_rows(DailyCarStats)
+        out = StringIO()
+        call_command('rebuild_stats', stdout=out)
+        self.assertIn('Rebuilt 2 exhibition days and 3 car days.', out.getvalue())
+        self.assertEqual(self.get_rows(DailyExhibitionStats), exhibition_rows)
+        self.assertEqual(self.get_rows(DailyCarStats), car_rows)
+
+    def test_dashboard_reads_rollups(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_credit')
+        self.answer_requests(staff_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('car_rental:stats'), {'days': '7'})
+        self.assertFalse([query for query in queries if 'car_rental_rentrequest' in query['sql']])
+        self.assertEqual(response.context['totals'], {'revenue': 290, 'rented_hours': 29, 'requests': 4,
+                                                      'rejections': 2})
+        self.assertEqual(response.context['fleet_size'], 2)
+        self.assertEqual([car['car__car_type'] for car in response.context['top_cars']], ['car1', 'car0'])
+        self.assertContains(response, '8.6%')
+
+    def test_dashboard_for_staff_only(self):
+        login_a_user(self.client)
+        self.assertEqual(self.client.get(reverse('car_rental:stats')).status_code, 403)
+
+    def test_dashboard_needs_credit_permission(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        self.assertNotContains(self.client.get(reverse('car_rental:home')), reverse('car_rental:stats'))
+        self.assertEqual(self.client.get(reverse('car_rental:stats')).status_code, 403)
+        staff_user.staff.add_permissions('can_access_credit')
+        self.assertContains(self.client.get(reverse('car_rental:home')), reverse('car_rental:stats'))
+
+    def test_rental_across_window_start(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_credit')
+        car = create_car(owner=staff_user.staff.exhibition)
+        start = self.get_start(8, 12)
+        rent_request = create_request(create_user(), car, start, start + datetime.timedelta(days=2))
+        self.assertTrue(rent_request.accept(staff_user))
+        rent_request.refresh_from_db()
+        self.assertEqual(list(DailyCarStats.objects.order_by('day').values_list('rented_hours', 'revenue')),
+                         [(12, rent_request.price // 4), (24, rent_request.price // 2), (12, rent_request.price // 4)])
+        response = self.client.get(reverse('car_rental:stats'), {'days': '7'})
+        self.assertEqual(response.context['totals']['rented_hours'], 12)
+        self.assertEqual(response.context['totals']['revenue'], rent_request.price // 4)
+        self.assertContains(response, '7.1%')
+
 
 class ProfileViewTest(TestCase):
 
@@ -593,6 +1113,62 @@ class CreditChangeViewTest(TestCase):
         self.assertEqual(response.status_code, 403)
 
 
+class CreditLedgerTest(TestCase):
+
+    def test_change_credit_records_transaction(self):
+        user = create_user()
+        user.change_credit(150)
+        user.change_credit(-50)
+        user.refresh_from_db()
+        self.assertEqual(user.credit, 100)
+        self.assertEqual(CreditTransaction.objects.for_account(user).count(), 2)
+        self.assertEqual(CreditTransaction.objects.balance(user), 100)
+
+    def test_staff_credit_goes_to_exhibition(self):
+        staff_user = create_user(is_staff=True)
+        staff_user.change_credit(70)
+        exhibition = staff_user.staff.exhibition
+        exhibition.refresh_from_db()
+        self.assertEqual(exhibition.credit, 70)
+        self.assertEqual(CreditTransaction.objects.balance(exhibition), 70)
+        self.assertFalse(CreditTransaction.objects.for_account(staff_user).exists())
+
+    def test_accept_records_rent_transactions(self):
+        staff_user = create_user(is_staff=True)
+        car = create_car(owner=staff_user.staff.exhibition)
+        requester = create_user('user1')
+        rent_request = create_request(requester, car, timezone.now(), timezone.now() + datetime.timedelta(hours=2))
+        rent_request.accept(staff_user)
+        self.assertEqual(CreditTransaction.objects.filter(rent_request=rent_request, reason='RENT').count(), 2)
+        self.assertEqual(CreditTransaction.objects.balance(requester), -rent_request.price)
+
+    def test_history_cursor(self):
+        user = create_user()
+        for i in range(5):
+            user.change_credit(i + 1)
+        first_page = CreditTransaction.objects.history(user, limit=3)
+        second_page = CreditTransaction.objects.history(user, before=first_page[-1].id, limit=3)
+        self.assertEqual([t.amount for t in first_page], [5, 4, 3])
+        self.assertEqual([t.amount for t in second_page], [2, 1])
+
+    def test_snapshot(self):
+        user = create_user()
+        user.change_credit(40)
+        call_command('snapshot_credits', stdout=StringIO(), stderr=StringIO())
+        snapshot = CreditSnapshot.objects.get(user=user)
+        self.assertEqual(snapshot.balance, 40)
+        user.change_credit(2)
+        self.assertEqual(CreditTransaction.objects.balance(user), 42)
+
+    def test_history_view(self):
+        user = login_a_user(self.client)
+        user.user_permissions.add(Permission.objects.get(codename='can_access_credit'))
+        user.change_credit(123)
+        response = self.client.get(reverse('car_rental:credit_history'))
+        self.assertContains(response, '123')
+        self.assertContains(response, 'Credit change')
+
+
 class LogoutViewTest(TestCase):
 
     def test_logout_successfully(self):
@@ -628,6 +1204,265 @@ class AddCarViewTest(TestCase):
         self.assertEqual(response.status_code, 403)
 
 
+def create_image_file(name='car.png', width=1200, height=800):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class TemporaryMediaMixin:
+    # Uploaded files go to a directory of the test class that is removed with it.
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        super(TemporaryMediaMixin, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TemporaryMediaMixin, cls).tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+@override_settings(CAR_IMAGE_DERIVATIVES_ASYNC=False)
+class CarImageTest(TemporaryMediaMixin, TestCase):
+
+    def test_derivatives_built_after_upload(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_car')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('car_rental:add_car'), {'car_type': 'type1', 'plate': '1234',
+                                                             'price_per_hour': '100', 'image': create_image_file()})
+        car = Car.objects.get()
+        self.assertEqual(sorted(car.image_derivatives), ['1024', '320', '640'])
+        for name in car.image_derivatives.values():
+            self.assertTrue(default_storage.exists(name))
+            self.assertTrue(name.endswith('.webp'))
+        self.assertEqual(Image.open(default_storage.open(car.image_derivatives['320'])).width, 320)
+        login_a_user(self.client)
+        response = self.client.get(reverse('car_rental:cars'))
+        self.assertContains(response, car.image_srcset())
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_small_image_not_enlarged(self):
+        car = create_car()
+        car.image = default_storage.save('cars/small.png', create_image_file(width=200, height=100))
+        car.save()
+        call_command('build_car_images', stdout=StringIO())
+        car.refresh_from_db()
+        self.assertEqual(list(car.image_derivatives), ['200'])
+
+    def test_backfill_command(self):
+        name = default_storage.save('cars/shared.png', create_image_file())
+        for i in range(2):
+            create_car(ex_name='ex' + str(i))
+        Car.objects.update(image=name)
+        out = StringIO()
+        call_command('build_car_images', stdout=out)
+        self.assertIn('Built images of 2 cars.', out.getvalue())
+        derivatives = [car.image_derivatives for car in Car.objects.all()]
+        self.assertEqual(derivatives[0], derivatives[1])
+        out = StringIO()
+        call_command('build_car_images', stdout=out)
+        self.assertIn('All car images are built.', out.getvalue())
+
+
+CARS_CSV = 'car_type,plate,price_per_hour,image\nsedan,1111,20,\ncoupe,2222,abc,\nvan,3333,30,car.png\n' \
+           'truck,4444,40,missing.png\n'
+
+
+@override_settings(CAR_IMAGE_DERIVATIVES_ASYNC=False)
+class CarImportTest(TemporaryMediaMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def create_archive(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('car.png', create_image_file(width=400, height=200).read())
+            zip_file.writestr('notes.txt', 'not an image')
+        archive.seek(0)
+        return archive
+
+    def test_import_cars_in_chunks(self):
+        exhibition = create_exhibition()
+        rows = [{'car_type': 'sedan %d' % i, 'plate': str(1000 + i), 'price_per_hour': 10 + i} for i in range(7)]
+        with CaptureQueriesContext(connection) as queries:
+            created, report = import_cars(exhibition, enumerate(rows, start=1), chunk_size=3)
+        self.assertEqual(created, 7)
+        self.assertEqual(report.count, 0)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "car_rental_car"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(exhibition.cars_owned.count(), 7)
+        self.assertEqual(list(search_cars(Car.objects.all(), 'sedan 6')), [Car.objects.get(plate='1006')])
+
+    def test_row_errors_and_images(self):
+        exhibition = create_exhibition()
+        images = ArchiveImages(self.create_archive())
+        rows = list(read_car_rows(StringIO(CARS_CSV))) + [(6, {'car_type': 'bus', 'image': 'notes.txt'})]
+        with self.captureOnCommitCallbacks(execute=True):
+            created, report = import_cars(exhibition, rows, images)
+        self.assertEqual(created, 2)
+        self.assertEqual([line for line, error in report.errors], [3, 5, 6])
+        self.assertIn('price_per_hour', report.errors[0][1])
+        self.assertIn('missing.png was not found', report.errors[1][1])
+        car = exhibition.cars_owned.get(car_type='van')
+        self.assertEqual(car.price_per_hour, 30)
+        self.assertEqual(list(car.image_derivatives), ['320'])
+
+    def test_images_saved_after_insert(self):
+        exhibition = create_exhibition()
+        images = ArchiveImages(self.create_archive())
+        rows = [(2, {'car_type': 'van', 'image': 'car.png'})]
+        names = []
+        save = default_storage.save
+
+        def record_save(name, content):
+            names.append(save(name, content))
+            return names[-1]
+
+        with mock.patch('car_rental.imports.default_storage.save', record_save), \
+                mock.patch('car_rental.imports.index_cars', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                import_cars(exhibition, rows, images)
+        self.assertEqual(len(names), 1)
+        self.assertFalse(default_storage.exists(names[0]))
+        self.assertEqual(exhibition.cars_owned.count(), 0)
+
+    def test_jsonl_rows(self):
+        rows = list(read_car_rows(StringIO('{"car_type": "sedan"}\n\nnot json\n[1]\n'), 'jsonl'))
+        created, report = import_cars(create_exhibition(), rows)
+        self.assertEqual(created, 1)
+        self.assertEqual([line for line, error in report.errors], [3, 4])
+
+    def test_import_command(self):
+        exhibition = create_exhibition()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with open(os.path.join(directory, 'car.png'), 'wb') as image_file:
+            image_file.write(create_image_file().read())
+        with open(os.path.join(directory, 'cars.csv'), 'w') as csv_file:
+            csv_file.write(CARS_CSV)
+        out = StringIO()
+        call_command('import_cars', exhibition.id, os.path.join(directory, 'cars.csv'), images=directory,
+                     report=os.path.join(directory, 'errors.csv'), stdout=out)
+        self.assertIn('Imported 2 cars, 2 rows have errors.', out.getvalue())
+        with open(os.path.join(directory, 'errors.csv')) as report_file:
+            self.assertEqual([row['line'] for row in csv.DictReader(report_file)], ['3', '5'])
+
+    def test_import_view(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_car')
+        upload = SimpleUploadedFile('cars.csv', CARS_CSV.encode())
+        images = SimpleUploadedFile('images.zip', self.create_archive().read())
+        response = self.client.post(reverse('car_rental:import_cars'), {'file': upload, 'images': images},
+                                    follow=True)
+        self.assertRedirects(response, reverse('car_rental:cars_staff'))
+        self.assertContains(response, '2 cars imported.')
+        self.assertContains(response, 'Line 5: Image missing.png was not found.')
+        self.assertEqual(staff_user.staff.exhibition.cars_owned.count(), 2)
+
+    def test_import_view_not_utf8(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_car')
+        upload = SimpleUploadedFile('cars.csv', 'car_type\nPeugeot 206 \u00e9\n'.encode('latin-1'))
+        response = self.client.post(reverse('car_rental:import_cars'), {'file': upload})
+        self.assertFormError(response, 'form', 'file', 'The file should be UTF-8 encoded text.')
+        self.assertEqual(staff_user.staff.exhibition.cars_owned.count(), 0)
+
+    def test_import_view_without_permission(self):
+        login_a_user(self.client, is_staff=True)
+        upload = SimpleUploadedFile('cars.csv', CARS_CSV.encode())
+        response = self.client.post(reverse('car_rental:import_cars'), {'file': upload})
+        self.assertEqual(response.status_code, 403)
+
+
+class BulkCarActionTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.staff_user = login_a_user(self.client, is_staff=True)
+        self.staff_user.staff.add_permissions('can_access_car')
+        exhibition = self.staff_user.staff.exhibition
+        self.cars = [create_car(car_type='sedan %d' % i, owner=exhibition) for i in range(3)]
+        self.rented_car = create_rented_car(owner=exhibition)
+        self.other_car = create_car()
+
+    def post_action(self, action, value='', cars=None, **params):
+        data = {'action': action, 'value': value, 'selection': [car.id for car in cars or []]}
+        data.update(params)
+        return self.client.post(reverse('car_rental:bulk_cars'), data, follow=True)
+
+    def get_prices(self):
+        return list(Car.objects.order_by('id').values_list('price_per_hour', flat=True))
+
+    def test_reprice_percent_in_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_action('reprice_percent', 25, self.cars + [self.rented_car, self.other_car])
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "car_rental_car"')]
+        self.assertEqual(len(updates), 1)
+        self.assertContains(response, '3 cars updated.')
+        self.assertContains(response, '2 selected cars are rented or booked and were not changed.')
+        self.assertEqual(self.get_prices(), [13, 13, 13, 10, 10])
+
+    def test_reprice_all_matching_search(self):
+        self.assertContains(self.client.get(reverse('car_rental:cars_staff')), 'name="selection"')
+        response = self.client.post(reverse('car_rental:bulk_cars') + '?car_type=sedan',
+                                    {'action': 'reprice_amount', 'value': 40, 'select_all': 'on'}, follow=True)
+        self.assertRedirects(response, reverse('car_rental:cars_staff') + '?car_type=sedan')
+        self.assertEqual(self.get_prices(), [40, 40, 40, 10, 10])
+
+    def test_repair_and_delete(self):
+        self.post_action('mark_repair', cars=[self.cars[0], self.rented_car])
+        self.assertEqual(list(Car.objects.filter(needs_repair=True).order_by('id')), [self.cars[0], self.rented_car])
+        create_request(create_user(), self.cars[1])
+        response = self.post_action('delete', cars=self.cars[1:] + [self.rented_car])
+        self.assertContains(response, '2 cars deleted.')
+        self.assertEqual(list(Car.objects.order_by('id')), [self.cars[0], self.rented_car, self.other_car])
+        self.assertEqual(RentRequest.objects.get().car, None)
+        self.assertEqual(list(search_cars(Car.objects.all(), 'sedan')), [self.cars[0]])
+
+    def test_delete_fleet_in_set_statements(self):
+        cars = [create_car(owner=self.staff_user.staff.exhibition) for i in range(20)]
+        key = get_car_fragment_keys(cars[0].id, cars[0].updated_at)[0]
+        caches['fragments'].set(key, 'card')
+        with CaptureQueriesContext(connection) as queries:
+            deleted = Car.objects.filter(id__in=[car.id for car in cars]).delete_fleet()
+        self.assertEqual(deleted, 20)
+        self.assertLessEqual(len(queries), 6)
+        self.assertIsNone(caches['fragments'].get(key))
+        self.assertEqual(list(search_cars(Car.objects.all(), 'type1')), [self.rented_car, self.other_car])
+
+    def test_booked_car_left_unchanged(self):
+        start_time = timezone.now() + datetime.timedelta(days=2)
+        rent_request = create_request(create_user(), self.cars[0], start_time, start_time + datetime.timedelta(hours=5))
+        rent_request.accept(self.staff_user)
+        response = self.post_action('delete', cars=self.cars[:2])
+        self.assertContains(response, '1 cars deleted.')
+        self.assertContains(response, '1 selected cars are rented or booked and were not changed.')
+        rent_request.refresh_from_db()
+        self.assertEqual(rent_request.car_id, self.cars[0].id)
+        self.assertFalse(Car.objects.filter(id=self.cars[1].id).exists())
+
+    def test_invalid_action(self):
+        response = self.post_action('reprice_percent', -100, self.cars)
+        self.assertContains(response, 'Enter a percent greater than -100.')
+        response = self.post_action('delete')
+        self.assertContains(response, 'Select at least one car.')
+        self.assertEqual(Car.objects.count(), 5)
+
+    def test_needs_car_permission(self):
+        login_a_user(self.client, is_staff=True)
+        response = self.client.post(reverse('car_rental:bulk_cars'), {'action': 'delete', 'selection': [1]})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('car_rental:cars_staff'))
+        self.assertNotContains(response, 'bulk-form')
+
+
 class EditCarTest(TestCase):
 
     def test_edit_price_successfully_with_car_permission(self):
@@ -686,6 +1521,43 @@ class EditCarTest(TestCase):
         self.assertEqual(car.price_per_hour, 10)
         self.assertEqual(response.status_code, 404)
 
+    def test_car_with_future_booking(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_car')
+        car = create_car(owner=staff_user.staff.exhibition)
+        start_time = timezone.now() + datetime.timedelta(days=2)
+        create_request(create_user(), car, start_time, start_time + datetime.timedelta(hours=5)).accept(staff_user)
+        response = self.client.post(reverse('car_rental:edit_car', kwargs={'pk': car.id}), {'price_per_hour': 100})
+        self.assertEqual(response.status_code, 404)
+
+
+class DeleteCarTest(TestCase):
+
+    def test_delete_free_car(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_car')
+        car = create_car(owner=staff_user.staff.exhibition)
+        response = self.client.get(reverse('car_rental:car', kwargs={'pk': car.id}))
+        self.assertContains(response, reverse('car_rental:delete_car', kwargs={'pk': car.id}))
+        response = self.client.post(reverse('car_rental:delete_car', kwargs={'pk': car.id}))
+        self.assertRedirects(response, reverse('car_rental:cars'), fetch_redirect_response=False)
+        self.assertFalse(Car.objects.filter(id=car.id).exists())
+
+    def test_car_with_future_booking(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_car')
+        car = create_car(owner=staff_user.staff.exhibition)
+        start_time = timezone.now() + datetime.timedelta(days=2)
+        rent_request = create_request(create_user(), car, start_time, start_time + datetime.timedelta(hours=5))
+        rent_request.accept(staff_user)
+        response = self.client.get(reverse('car_rental:car', kwargs={'pk': car.id}))
+        self.assertNotContains(response, reverse('car_rental:delete_car', kwargs={'pk': car.id}))
+        self.assertNotContains(response, reverse('car_rental:edit_car', kwargs={'pk': car.id}))
+        response = self.client.post(reverse('car_rental:delete_car', kwargs={'pk': car.id}))
+        self.assertEqual(response.status_code, 404)
+        rent_request.refresh_from_db()
+        self.assertEqual(rent_request.car_id, car.id)
+
 
 class NeedRepairViewTest(TestCase):
 
@@ -789,6 +1661,42 @@ class UserDetailViewTest(TestCase):
         self.assertContains(response, user2.id)
         self.assertContains(response, 'Renter')
 
+    def test_customer_of_other_exhibition(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        user2 = create_user('user2')
+        create_request(user2, create_car(ex_name='ex2'))
+        response = self.client.get(reverse('car_rental:user_info', kwargs={'pk': user2.id}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_query_count_does_not_depend_on_requests(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        car = create_car(owner=staff_user.staff.exhibition)
+        user2 = create_user('user2')
+        create_request(user2, car)
+        self.client.get(reverse('car_rental:user_info', kwargs={'pk': user2.id}))
+        with CaptureQueriesContext(connection) as few_requests:
+            self.client.get(reverse('car_rental:user_info', kwargs={'pk': user2.id}))
+        for i in range(10):
+            create_request(create_user(), car)
+        with CaptureQueriesContext(connection) as many_requests:
+            self.client.get(reverse('car_rental:user_info', kwargs={'pk': user2.id}))
+        self.assertEqual(len(few_requests), len(many_requests))
+
+    @override_settings(EXHIBITION_CUSTOMER_CACHE_TIMEOUT=60)
+    def test_cached_customers_invalidated_on_new_request(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        car = create_car(owner=staff_user.staff.exhibition)
+        create_request(create_user('user1'), car)
+        user2 = create_user('user2')
+        response = self.client.get(reverse('car_rental:user_info', kwargs={'pk': user2.id}))
+        self.assertEqual(response.status_code, 404)
+        create_request(user2, car)
+        response = self.client.get(reverse('car_rental:user_info', kwargs={'pk': user2.id}))
+        self.assertEqual(response.status_code, 200)
+
 
 class SignupViewTest(TestCase):
 
@@ -873,6 +1781,67 @@ class CreateStaffViewTest(TestCase):
         self.assertTrue(new_staff.is_senior)
 
 
+STAFF_CSV = 'username,password,type\nnormal1,qw12er34ty,N\nsenior1,qw12er34ty,S\nnormal1,qw12er34ty,N\n,qw12er34ty,N\n'
+
+
+class StaffImportTest(TestCase):
+
+    def test_import_staff(self):
+        exhibition = create_exhibition()
+        rows = [{'username': 'normal1', 'password': 'qw12er34ty', 'type': 'N'},
+                {'username': 'senior1', 'password': 'qw12er34ty', 'type': 'S'},
+                {'username': 'senior2', 'password': 'qw12er34ty', 'type': 'S'}]
+        created, errors = import_staff(exhibition, rows, workers=2)
+        self.assertEqual(created, 3)
+        self.assertEqual(errors, [])
+        self.assertEqual(exhibition.staff_set.count(), 3)
+        senior = User.objects.get(username='senior1')
+        self.assertTrue(senior.is_staff)
+        self.assertTrue(senior.check_password('qw12er34ty'))
+        self.assertTrue(senior.has_perm('car_rental.can_access_staff'))
+        self.assertFalse(User.objects.get(username='normal1').has_perm('car_rental.can_access_credit'))
+
+    def test_import_errors(self):
+        exhibition = create_exhibition()
+        create_user('taken1')
+        rows = [{'username': 'taken1', 'password': 'qw12er34ty', 'type': 'N'},
+                {'username': 'new1', 'password': '1', 'type': 'N'},
+                {'username': 'new2', 'password': 'qw12er34ty', 'type': 'X'}]
+        created, errors = import_staff(exhibition, rows, workers=1)
+        self.assertEqual(created, 0)
+        self.assertEqual([line for line, error in errors], [2, 3, 4])
+
+    def test_import_command(self):
+        exhibition = create_exhibition()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write(STAFF_CSV)
+        stderr = StringIO()
+        call_command('import_staff', exhibition.id, csv_file.name, workers=1, stdout=StringIO(), stderr=stderr)
+        os.remove(csv_file.name)
+        self.assertEqual(exhibition.staff_set.count(), 2)
+        self.assertIn('Line 4', stderr.getvalue())
+        self.assertIn('Line 5', stderr.getvalue())
+
+    @override_settings(STAFF_IMPORT_WORKERS=1)
+    def test_import_view_senior(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.is_senior = True
+        staff_user.staff.save()
+        staff_user.staff.add_permissions('can_access_staff')
+        upload = SimpleUploadedFile('staff.csv', STAFF_CSV.encode())
+        response = self.client.post(reverse('car_rental:import_staff'), {'file': upload}, follow=True)
+        self.assertRedirects(response, reverse('car_rental:staff'))
+        self.assertContains(response, '2 staff imported.')
+        self.assertEqual(staff_user.staff.exhibition.staff_set.count(), 3)
+
+    def test_import_view_normal_staff(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_staff')
+        upload = SimpleUploadedFile('staff.csv', STAFF_CSV.encode())
+        response = self.client.post(reverse('car_rental:import_staff'), {'file': upload})
+        self.assertEqual(response.status_code, 403)
+
+
 class StaffListViewTest(TestCase):
 
     def test_not_staff(self):
@@ -1029,3 +1998,525 @@ class ChangePermissionsViewTest(TestCase):
         self.assertRedirects(response, reverse('car_rental:staff_detail', kwargs={'pk': staff2.id}))
         self.assertTrue(staff2.user.has_perm('car_rental.can_access_staff'))
 
+
+class RelationLoadingTest(TestCase):
+
+    def assertConstantQueries(self, url, add_row):
+        add_row()
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as one_row:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for i in range(3):
+            add_row()
+        with CaptureQueriesContext(connection) as many_rows:
+            self.client.get(url)
+        self.assertEqual(len(one_row), len(many_rows))
+
+    @override_settings(CAR_CATALOG_CACHE_TIMEOUT=0)
+    def test_car_list(self):
+        login_a_user(self.client)
+        self.assertConstantQueries(reverse('car_rental:cars'),
+                                   lambda: create_car(ex_name='ex' + str(Car.objects.count())))
+
+    def test_car_list_staff(self):
+        owner = login_a_user(self.client, is_staff=True).staff.exhibition
+        self.assertConstantQueries(reverse('car_rental:cars_staff'), lambda: create_rented_car(
+            renter=create_user(), owner=owner))
+
+    def test_request_list_renter(self):
+        renter = login_a_user(self.client)
+        self.assertConstantQueries(reverse('car_rental:requests_renter'), lambda: create_request(
+            renter, create_car(ex_name='ex' + str(Car.objects.count()))))
+
+    def test_request_list_staff(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        owner = staff_user.staff.exhibition
+        self.assertConstantQueries(reverse('car_rental:requests_staff'), lambda: create_request(
+            create_user(), create_car(owner=owner)))
+
+    def test_staff_list(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_staff')
+        exhibition = staff_user.staff.exhibition
+        self.assertConstantQueries(reverse('car_rental:staff'),
+                                   lambda: create_user(is_staff=True, exhibition=exhibition))
+
+    def test_staff_detail(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_access_staff')
+        exhibition = staff_user.staff.exhibition
+        other_staff = create_user(is_staff=True, exhibition=exhibition).staff
+
+        def add_answered_request():
+            rent_request = create_request(create_user(), create_car(owner=exhibition))
+            rent_request.has_result = True
+            rent_request.responser = other_staff
+            rent_request.save()
+
+        self.assertConstantQueries(reverse('car_rental:staff_detail', kwargs={'pk': other_staff.id}),
+                                   add_answered_request)
+
+    def test_profile(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        exhibition = staff_user.staff.exhibition
+
+        def add_answered_request():
+            rent_request = create_request(create_user(), create_car(owner=exhibition))
+            rent_request.has_result = True
+            rent_request.responser = staff_user.staff
+            rent_request.save()
+
+        self.assertConstantQueries(reverse('car_rental:profile'), add_answered_request)
+
+
+class ExplainQueriesTest(TestCase):
+
+    def test_views_use_indexes(self):
+        out = StringIO()
+        call_command('explain_queries', '--current-database', '--json', '--fail', stdout=out)
+        reports = {report['query']: report for report in json.loads(out.getvalue())}
+        self.assertIn('rentrequest_renter_idx', reports['car_rental:requests_renter']['plan'])
+        self.assertIn('car_owner_popularity_idx', reports['car_rental:cars_staff?ordering=-popularity']['plan'])
+        self.assertIn('rentrequest_pending_idx', reports['car_rental:requests_staff']['plan'])
+        self.assertEqual(User.objects.filter(username__startswith='explain_').count(), 0)
+
+
+class BenchmarkUrlsTest(TestCase):
+
+    def test_report(self):
+        out = StringIO()
+        call_command('benchmark_urls', '--current-database', '--exhibitions', '2', '--cars', '4', '--requests', '20',
+                     '--renters', '3', '--iterations', '2', '--route', 'cars', '--route', 'requests_staff',
+                     '--route', 'car', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['dataset'], {'exhibitions': 2, 'cars': 4, 'requests': 20, 'renters': 3, 'staff': 6})
+        self.assertEqual(len(report['results']), 12)
+        self.assertEqual(report['results']['cars renter']['status'], 200)
+        self.assertEqual(report['results']['cars senior']['status'], 403)
+        self.assertEqual(report['results']['requests_staff junior']['status'], 200)
+        self.assertEqual(report['results']['requests_staff renter']['status'], 403)
+        for result in report['results'].values():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['peak_memory_kb'], 0)
+        self.assertEqual(RentRequest.objects.count(), 0)
+        self.assertEqual(User.objects.count(), 0)
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_car_list_staff_pages(self):
+        owner = login_a_user(self.client, is_staff=True).staff.exhibition
+        for i in range(10):
+            create_car(owner=owner)
+        response = self.client.get(reverse('car_rental:cars_staff'))
+        first_page = [car.id for car in response.context['cars']]
+        self.assertEqual(len(first_page), 7)
+        self.assertEqual(response.context['keyset_page']['total'], 10)
+        self.assertIsNone(response.context['keyset_page']['previous_url'])
+        response = self.client.get(reverse('car_rental:cars_staff') + response.context['keyset_page']['next_url'])
+        second_page = [car.id for car in response.context['cars']]
+        self.assertEqual(len(second_page), 3)
+        self.assertFalse(set(first_page) & set(second_page))
+        self.assertIsNone(response.context['keyset_page']['next_url'])
+        response = self.client.get(reverse('car_rental:cars_staff') + response.context['keyset_page']['previous_url'])
+        self.assertEqual([car.id for car in response.context['cars']], first_page)
+
+    def test_request_list_renter_ties_and_query_cost(self):
+        renter = login_a_user(self.client)
+        car = create_car()
+        start_time = timezone.now()
+        for i in range(16):
+            create_request(renter, car, start_time=start_time)
+        url = reverse('car_rental:requests_renter')
+        seen = []
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(url)
+        seen += [rent_request.id for rent_request in response.context['requests']]
+        while response.context['keyset_page']['next_url']:
+            with CaptureQueriesContext(connection) as page:
+                response = self.client.get(url + response.context['keyset_page']['next_url'])
+            self.assertEqual(len(page), len(first_page))
+            seen += [rent_request.id for rent_request in response.context['requests']]
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(set(seen)), 16)
+
+    def test_invalid_cursor_shows_first_page(self):
+        owner = login_a_user(self.client, is_staff=True).staff.exhibition
+        create_car(owner=owner)
+        response = self.client.get(reverse('car_rental:cars_staff') + '?after=garbage')
+        self.assertEqual(len(response.context['cars']), 1)
+
+
+class QueryStatsTest(QueryBudgetMixin, TestCase):
+
+    def test_middleware_records_view(self):
+        query_stats.reset()
+        login_a_user(self.client)
+        create_car()
+        self.client.get(reverse('car_rental:cars'))
+        self.client.get(reverse('car_rental:cars'))
+        stats = query_stats.snapshot()['car_rental:cars']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['avg_queries'], 0)
+
+    async def test_middleware_records_async_view(self):
+        query_stats.reset()
+        car = await sync_to_async(create_car)()
+        await sync_to_async(login_a_user)(self.async_client)
+        response = await self.async_client.get(reverse('car_rental:car', kwargs={'pk': car.id}))
+        self.assertEqual(response.status_code, 200)
+        stats = query_stats.snapshot()['car_rental:car']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreaterEqual(stats['max_queries'], 3)
+
+    def test_repeated_shapes(self):
+        for i in range(3):
+            create_car()
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            owner_names = [car.owner.name for car in Car.objects.all()]
+            list(Car.objects.filter(id__in=[1, 2]))
+            list(Car.objects.filter(id__in=[1, 2, 3]))
+        self.assertEqual(len(owner_names), 3)
+        self.assertEqual(sorted(recorder.repeated_shapes().values()), [2, 3])
+
+    def test_stats_endpoint_superuser_only(self):
+        login_a_user(self.client, is_staff=True)
+        response = self.client.get(reverse('car_rental:query_stats'))
+        self.assertEqual(response.status_code, 302)
+        superuser = User.objects.create_superuser('admin', password='1111')
+        self.client.force_login(superuser)
+        self.client.get(reverse('car_rental:home'))
+        response = self.client.get(reverse('car_rental:query_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('car_rental:home', response.json())
+
+    def test_user_info_budget(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        car = create_car(owner=staff_user.staff.exhibition)
+        user2 = create_user('user2')
+        for i in range(5):
+            create_request(user2, car)
+        with self.assertQueryBudget(8, max_repeats=2):
+            self.client.get(reverse('car_rental:user_info', kwargs={'pk': user2.id}))
+
+    def test_answer_requests_budget(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        answers = {}
+        for i in range(5):
+            car = create_car(owner=staff_user.staff.exhibition)
+            answers[str(create_request(create_user(), car).id)] = 'no'
+        with self.assertQueryBudget(20, max_repeats=2):
+            self.client.post(reverse('car_rental:answer_requests'), answers)
+
+
+def open_writer_connection(path, alias='writers'):
+    settings_dict = dict(connections['default'].settings_dict, NAME=path, OPTIONS={'timeout': 5})
+    connections[alias] = load_backend('car_site.sqlite').DatabaseWrapper(settings_dict, alias)
+    return connections[alias]
+
+
+def increment_counter(path, writes, results):
+    writer = open_writer_connection(path)
+
+    @write_transaction(using='writers')
+    def increment():
+        with writer.cursor() as cursor:
+            cursor.execute('SELECT value FROM counter')
+            value = cursor.fetchone()[0]
+            cursor.execute('UPDATE counter SET value = %s', [value + 1])
+
+    done = 0
+    for i in range(writes):
+        try:
+            increment()
+            done += 1
+        except OperationalError:
+            pass
+    writer.close()
+    results.put(done)
+
+
+@override_settings(WRITE_RETRY_ATTEMPTS=10, WRITE_RETRY_DELAY=0.01)
+class SqliteWriteTest(SimpleTestCase):
+    # Checks that concurrent writers lose no update and are retried on lock errors. Throughput under
+    # contention is not measured here.
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'write.sqlite3')
+        writer = open_writer_connection(self.path)
+        with writer.cursor() as cursor:
+            cursor.execute('CREATE TABLE counter (value INTEGER)')
+            cursor.execute('INSERT INTO counter VALUES (0)')
+        self.writer = writer
+
+    def tearDown(self):
+        self.writer.close()
+
+    def get_counter(self):
+        with self.writer.cursor() as cursor:
+            cursor.execute('SELECT value FROM counter')
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        with self.writer.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_lock_error_retried(self):
+        attempts = []
+
+        @write_transaction(using='writers')
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        self.assertEqual(flaky(), 'done')
+        self.assertEqual(len(attempts), 3)
+
+    def test_eight_writer_processes(self):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [context.Process(target=increment_counter, args=(self.path, 50, results)) for i in range(8)]
+        for worker in workers:
+            worker.start()
+        done = [results.get(timeout=120) for worker in workers]
+        for worker in workers:
+            worker.join()
+        self.assertEqual(done, [50] * 8)
+        self.assertEqual(self.get_counter(), 400)
+
+
+class AsyncViewsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_async_views_selected(self):
+        for name, kwargs in [('car_rental:home', {}), ('car_rental:cars', {}), ('car_rental:car', {'pk': 1}),
+                             ('car_rental:requests_renter', {})]:
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(reverse(name, kwargs=kwargs)).func))
+
+    async def test_catalog_over_asgi(self):
+        await sync_to_async(create_car)()
+        response = await self.async_client.get(reverse('car_rental:cars'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cars']), 1)
+        with mock.patch('car_rental.async_views.load_catalog') as load_catalog:
+            response = await self.async_client.get(reverse('car_rental:cars'))
+        load_catalog.assert_not_called()
+        self.assertContains(response, 'type1')
+
+    async def test_catalog_forbidden_for_staff(self):
+        await sync_to_async(login_a_user)(self.async_client, is_staff=True)
+        response = await self.async_client.get(reverse('car_rental:cars'))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_car_detail_over_asgi(self):
+        car = await sync_to_async(create_car)()
+        response = await self.async_client.get(reverse('car_rental:car', kwargs={'pk': car.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['is_owner'])
+        response = await self.async_client.get(reverse('car_rental:car', kwargs={'pk': car.id + 100}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_rent_request_list_over_asgi(self):
+        response = await self.async_client.get(reverse('car_rental:requests_renter'))
+        self.assertRedirects(response, reverse('car_rental:login') + "?next=" + reverse('car_rental:requests_renter'),
+                             fetch_redirect_response=False)
+        car = await sync_to_async(create_car)()
+        user = await sync_to_async(login_a_user)(self.async_client)
+        await sync_to_async(create_request)(user, car)
+        response = await self.async_client.get(reverse('car_rental:requests_renter'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['requests']), 1)
+        self.assertContains(response, 'type1')
+        await sync_to_async(login_a_user)(self.async_client, is_staff=True)
+        response = await self.async_client.get(reverse('car_rental:requests_renter'))
+        self.assertEqual(response.status_code, 403)
+
+
+def event_scope(client):
+    cookie = client.cookies.get(settings.SESSION_COOKIE_NAME)
+    return {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'root_path': '',
+            'path': reverse('car_rental:events'), 'query_string': b'', 'client': ('127.0.0.1', 0),
+            'server': ('testserver', 80),
+            'headers': [(b'cookie', ('%s=%s' % (cookie.key, cookie.value)).encode())] if cookie else []}
+
+
+class EventsTest(TestCase):
+
+    def setUp(self):
+        # Like the test client, keep the end of the stream's request from closing the test transaction.
+        signals.request_started.disconnect(close_old_connections)
+        signals.request_finished.disconnect(close_old_connections)
+        self.addCleanup(signals.request_started.connect, close_old_connections)
+        self.addCleanup(signals.request_finished.connect, close_old_connections)
+
+    async def test_broker_delivers_across_threads(self):
+        broker = Broker()
+        subscription = broker.subscribe([user_channel(1)])
+        await sync_to_async(broker.publish, thread_sensitive=False)(user_channel(1), 'answered', {'id': 3})
+        broker.publish(user_channel(2), 'answered', {'id': 4})
+        event = await asyncio.wait_for(subscription.get(), 1)
+        self.assertEqual(event, {'event': 'answered', 'data': {'id': 3}})
+        self.assertTrue(subscription.queue.empty())
+        subscription.close()
+        self.assertFalse(broker.subscriptions)
+
+    def test_requests_publish_on_commit(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request')
+        exhibition = staff_user.staff.exhibition
+        car = create_car(owner=exhibition)
+        renter = create_user()
+        with mock.patch.object(get_broker(), 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                rent_request = create_request(renter, car)
+                publish.assert_not_called()
+            publish.assert_called_once_with(exhibition_channel(exhibition.id), 'new_request', {'id': rent_request.id})
+            publish.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('car_rental:answer_requests'), {str(rent_request.id): 'yes'})
+        publish.assert_has_calls([
+            mock.call(user_channel(renter.id), 'answered', {'id': rent_request.id, 'accepted': True,
+                                                            'car': car.car_type}),
+            mock.call(exhibition_channel(exhibition.id), 'answered', {'ids': [rent_request.id]}),
+        ], any_order=True)
+
+    async def test_stream(self):
+        staff_user = await sync_to_async(login_a_user)(self.async_client, is_staff=True)
+        await sync_to_async(staff_user.staff.add_permissions)('can_answer_request')
+        exhibition_id = await sync_to_async(lambda: staff_user.staff.exhibition_id)()
+        received = asyncio.Queue()
+        sent = asyncio.Queue()
+        stream = asyncio.ensure_future(event_stream(event_scope(self.async_client), received.get, sent.put))
+        start = await asyncio.wait_for(sent.get(), 5)
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertTrue((await sent.get())['body'].startswith(b'retry:'))
+        get_broker().publish(exhibition_channel(exhibition_id + 1), 'new_request', {'id': 1})
+        await sync_to_async(get_broker().publish, thread_sensitive=False)(
+            exhibition_channel(exhibition_id), 'new_request', {'id': 2})
+        message = await asyncio.wait_for(sent.get(), 5)
+        self.assertEqual(message['body'], b'event: new_request\ndata: {"id": 2}\n\n')
+        await received.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(stream, 5)
+        self.assertNotIn(exhibition_channel(exhibition_id), get_broker().subscriptions)
+
+    async def test_stream_channels(self):
+        renter = await sync_to_async(login_a_user)(self.client)
+        staff_user = await sync_to_async(create_user)(is_staff=True)
+        channels = await sync_to_async(lambda: get_event_channels(get_actor(renter)))()
+        self.assertEqual(channels, [user_channel(renter.id)])
+        self.assertEqual(await sync_to_async(lambda: get_event_channels(get_actor(staff_user)))(),
+                         [user_channel(staff_user.id)])
+
+    async def test_stream_forbidden_for_anonymous(self):
+        sent = asyncio.Queue()
+        await asyncio.wait_for(event_stream(event_scope(self.async_client), asyncio.Queue().get, sent.put), 5)
+        self.assertEqual((await sent.get())['status'], 403)
+
+    async def test_router(self):
+        application = mock.AsyncMock()
+        router = route_events(application)
+        scope = {'type': 'http', 'path': reverse('car_rental:cars'), 'root_path': ''}
+        await router(scope, None, None)
+        application.assert_awaited_once_with(scope, None, None)
+        with mock.patch('car_rental.async_views.event_stream') as stream:
+            await router(event_scope(self.async_client), None, None)
+        stream.assert_called_once()
+        self.assertEqual(application.await_count, 1)
+
+    def test_events_view_without_asgi(self):
+        login_a_user(self.client)
+        self.assertEqual(self.client.get(reverse('car_rental:events')).status_code, 204)
+
+
+class ActorTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_staff_pages_read_cached_actor(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        staff_user.staff.add_permissions('can_answer_request', 'can_access_car', 'can_access_staff')
+        for name in ('car_rental:requests_staff', 'car_rental:cars_staff', 'car_rental:staff', 'car_rental:profile'):
+            self.client.get(reverse(name))
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['actor'].exhibition.id, staff_user.staff.exhibition_id)
+            tables = ' '.join(query['sql'] for query in queries)
+            self.assertNotIn('auth_permission', tables)
+            self.assertNotIn('FROM "car_rental_staff" WHERE "car_rental_staff"."user_id"', tables)
+
+    def test_change_permissions_invalidates(self):
+        senior = login_a_user(self.client, is_staff=True)
+        senior.staff.add_permissions('can_access_staff')
+        other = create_user(is_staff=True, exhibition=senior.staff.exhibition)
+        other.staff.add_permissions('can_answer_request')
+        other_client = self.client_class()
+        other_client.force_login(other)
+        self.assertEqual(other_client.get(reverse('car_rental:requests_staff')).status_code, 200)
+        stale_key = actor_cache_key(User.objects.get(id=other.id))
+        self.client.post(reverse('car_rental:staff_perms', kwargs={'pk': other.staff.id}), {'perms': ['CAR']})
+        # The entry stays behind, as it would in the cache of another worker, and is no longer read.
+        self.assertIsNotNone(cache.get(stale_key))
+        self.assertEqual(other_client.get(reverse('car_rental:requests_staff')).status_code, 403)
+        self.assertEqual(other_client.get(reverse('car_rental:add_car')).status_code, 200)
+
+    def test_staff_creation_invalidates(self):
+        user = create_user()
+        self.assertFalse(get_actor(user).is_staff)
+        Staff.objects.create(user=user, exhibition=create_exhibition(), is_senior=True)
+        user = User.objects.get(id=user.id)
+        self.assertIsNone(cache.get(actor_cache_key(user)))
+        actor = get_actor(user)
+        self.assertTrue(actor.is_staff)
+        self.assertTrue(actor.staff.is_senior)
+        self.assertTrue(actor.has_perm('car_rental.can_access_credit'))
+
+    def test_change_credit_through_cached_exhibition(self):
+        staff_user = login_a_user(self.client, is_staff=True)
+        exhibition = staff_user.staff.exhibition
+        exhibition.change_credit(100)
+        staff_user.staff.add_permissions('can_access_credit')
+        self.client.get(reverse('car_rental:profile'))
+        response = self.client.post(reverse('car_rental:change_credit'), {'delta_credit': 10})
+        actor = response.wsgi_request.actor
+        self.assertEqual(actor.exhibition.credit, 110)
+        exhibition.refresh_from_db()
+        self.assertEqual(exhibition.credit, 110)
+
+    def test_stale_instance_keeps_new_version(self):
+        user = create_user()
+        stale = User.objects.get(id=user.id)
+        Permission.objects.get(codename='can_access_car').user_set.add(user)
+        version = User.objects.get(id=user.id).actor_version
+        self.assertNotEqual(version, stale.actor_version)
+        stale.first_name = 'Farhad'
+        stale.save()
+        version, stale.actor_version = User.objects.get(id=user.id).actor_version, version
+        self.assertNotIn(version, (user.actor_version, stale.actor_version))
+        user.save(update_fields=['credit'])
+        self.assertEqual(User.objects.get(id=user.id).actor_version, version)
+
+    def test_anonymous(self):
+        response = self.client.get(reverse('car_rental:home'))
+        self.assertFalse(response.wsgi_request.actor.is_staff)
+        self.assertFalse(response.wsgi_request.actor.permissions)
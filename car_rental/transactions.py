@@ -0,0 +1,53 @@
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+
+def is_lock_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def get_backoff(attempt):
+    delay = getattr(settings, 'WRITE_RETRY_DELAY', 0.05) * 2 ** attempt
+    return random.uniform(0, min(delay, getattr(settings, 'WRITE_RETRY_MAX_DELAY', 1)))
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    connection = transaction.get_connection(using)
+    outermost = not connection.in_atomic_block
+    if outermost:
+        connection.force_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            connection.force_immediate = False
+            yield
+    finally:
+        if outermost:
+            connection.force_immediate = False
+
+
+def write_transaction(function=None, using=None):
+    def decorator(function):
+        @wraps(function)
+        def wrapped(*args, **kwargs):
+            attempts = getattr(settings, 'WRITE_RETRY_ATTEMPTS', 5)
+            for attempt in range(attempts):
+                nested = transaction.get_connection(using).in_atomic_block
+                try:
+                    with immediate_atomic(using):
+                        return function(*args, **kwargs)
+                except OperationalError as error:
+                    if nested or attempt == attempts - 1 or not is_lock_error(error):
+                        raise
+                time.sleep(get_backoff(attempt))
+        return wrapped
+
+    if function is None:
+        return decorator
+    return decorator(function)
@@ -1,61 +1,114 @@
+import csv
+import datetime
+import io
+import zipfile
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, update_session_auth_hash, logout
-from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.auth.decorators import login_required, permission_required, user_passes_test
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.auth.models import Permission
-from django.http import HttpResponseRedirect
+from django.db.models import Sum
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
+from django.utils.formats import date_format
 from django.views import generic
+from django.views.decorators.http import require_POST
 from django_filters import views as filter_views
 from django_tables2.views import SingleTableMixin
 
 from . import decorators
 from . import filters as my_filters
 from .forms import StaffCreationForm
-from .models import Car, RentRequest, User, Exhibition, Staff
+from .imports import ArchiveImages, ErrorReport, import_car_file, import_staff
+from .query_stats import query_stats
+from .transactions import write_transaction
+from .models import Car, RentRequest, User, Exhibition, Staff, CreditTransaction, DailyCarStats, DailyStats, \
+    apply_credit_transactions
 from . import forms as my_forms
 from . import tables as my_tables
+from .catalog import get_catalog
+from .images import schedule_derivatives
+from .mixins import KeysetPaginationMixin, RelationLoadingMixin
 
 
 @method_decorator(decorators.user_is_not_staff, name='dispatch')
-class CarListRenterView(filter_views.FilterView):
+class CarListRenterView(RelationLoadingMixin, filter_views.FilterView):
     template_name = 'car_rental/car_list.html'
     model = Car
     context_object_name = 'cars'
-    filterset_class = my_filters.CarFilterSet
+    filterset_class = my_filters.CarRenterFilterSet
+    select_related = ('owner',)
+    only_fields = ('id', 'car_type', 'price_per_hour', 'image', 'image_derivatives', 'updated_at', 'owner__name')
 
-    def get_queryset(self):
-        return Car.objects.exclude(rent_end_time__gt=timezone.now()).filter(needs_repair=False)
+    def get_filterset_kwargs(self, filterset_class):
+        kwargs = super(CarListRenterView, self).get_filterset_kwargs(filterset_class)
+        kwargs['data'] = self.request.GET
+        return kwargs
+
+    def get_base_queryset(self):
+        return Car.objects.filter(needs_repair=False)
+
+    def get_context_data(self, **kwargs):
+        if self.filterset.is_valid():
+            kwargs['object_list'] = get_catalog(self.request.GET, self.object_list)
+        return super(CarListRenterView, self).get_context_data(**kwargs)
 
 
 @method_decorator(decorators.user_is_staff, name='dispatch')
-class CarListStaffView(SingleTableMixin, filter_views.FilterView):
+class CarListStaffView(KeysetPaginationMixin, RelationLoadingMixin, SingleTableMixin, filter_views.FilterView):
     template_name = 'car_rental/car_list_staff.html'
     model = Car
     context_object_name = 'cars'
-    paginate_by = 7
-    filterset_class = my_filters.CarFilterSet
+    filterset_class = my_filters.CarStaffFilterSet
     table_class = my_tables.CarStaffTable
+    only_fields = ('id', 'owner', 'car_type', 'plate', 'status', 'request_count')
+    keyset_fields = ('id',)
+    keyset_orderings = {'popularity': ('request_count', 'id'), '-popularity': ('-request_count', '-id'),
+                        'status': ('status', 'id'), '-status': ('-status', '-id')}
+    keyset_count = 'cached'
 
-    def get_queryset(self):
-        current_user = self.request.user
-        return current_user.staff.exhibition.cars_owned.all()
+    def get_base_queryset(self):
+        return self.request.actor.exhibition.cars_owned.all()
+
+    def get_table_kwargs(self):
+        kwargs = super(CarListStaffView, self).get_table_kwargs()
+        if not self.request.user.has_perm('car_rental.can_access_car'):
+            kwargs['exclude'] = ('selection',)
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super(CarListStaffView, self).get_context_data(**kwargs)
+        context['bulk_form'] = my_forms.CarBulkActionForm()
+        return context
 
 
-class CarDetailView(generic.DetailView):
+class CarDetailView(RelationLoadingMixin, generic.DetailView):
     model = Car
     context_object_name = 'car'
     template_name = 'car_rental/car_detail.html'
+    select_related = ('owner', 'renter')
 
-    def get_queryset(self):
+    def get_base_queryset(self):
         return Car.objects.all()
 
+    def get_context_data(self, **kwargs):
+        context = super(CarDetailView, self).get_context_data(**kwargs)
+        actor = self.request.actor
+        context['is_owner'] = actor.is_staff and actor.exhibition.id == self.object.owner_id
+        context['is_rented'] = self.object.is_rented()
+        # Same rule as EditCarView and DeleteCarView, so their buttons never lead to a 404.
+        context['is_editable'] = context['is_owner'] and self.object.is_without_bookings_after(timezone.now())
+        return context
+
 
 @login_required()
+@write_transaction
 def rent_request_view(request, pk):
     car = get_object_or_404(Car, id=pk)
     if request.method == 'POST':
@@ -63,6 +116,16 @@ def rent_request_view(request, pk):
         if form.is_valid():
             rent_start_time = form.cleaned_data.get('rent_start_time')
             rent_end_time = form.cleaned_data.get('rent_end_time')
+            free_time = car.get_next_free_time(rent_start_time, rent_end_time)
+            if free_time != rent_start_time:
+                messages.error(request, 'This car is not free in the requested time. '
+                               'It is next free for that length of time from '
+                               + date_format(timezone.localtime(free_time), 'DATETIME_FORMAT') + '.')
+                return HttpResponseRedirect(reverse('car_rental:car', kwargs={'pk': pk}))
+            pending = RentRequest.objects.filter(car=car, requester=request.user, has_result=False)
+            if pending.overlapping(rent_start_time, rent_end_time).exists():
+                messages.error(request, 'You have already requested this car in this time.')
+                return HttpResponseRedirect(reverse('car_rental:car', kwargs={'pk': pk}))
             rent_req = RentRequest.objects.create(car=car, requester=request.user, rent_end_time=rent_end_time,
                                                   rent_start_time=rent_start_time)
             rent_req.save()
@@ -73,61 +136,93 @@ def rent_request_view(request, pk):
 
 @method_decorator(login_required, name='dispatch')
 @method_decorator(decorators.user_is_not_staff, name='dispatch')
-class RentRequestRenterListView(SingleTableMixin, filter_views.FilterView):
+class RentRequestRenterListView(KeysetPaginationMixin, RelationLoadingMixin, SingleTableMixin,
+                                filter_views.FilterView):
     template_name = 'car_rental/request_list_renter.html'
     model = RentRequest
     context_object_name = 'requests'
-    paginate_by = 7
     filterset_class = my_filters.RentRequestFilterSet
     table_class = my_tables.RentRequestRenterTable
+    select_related = ('car__owner',)
+    only_fields = ('requester', 'rent_start_time', 'rent_end_time', 'has_result', 'is_accepted', 'car__car_type',
+                   'car__owner__name')
+    keyset_fields = ('-rent_start_time', '-id')
+    keyset_count = 'bounded'
 
-    def get_queryset(self):
+    def get_base_queryset(self):
         current_user = self.request.user
-        return current_user.rentrequest_set.all().order_by('-rent_start_time')
+        return current_user.rentrequest_set.all()
 
 
 @method_decorator(login_required, name='dispatch')
 @method_decorator(decorators.user_is_staff, name='dispatch')
-class RentRequestStaffListView(PermissionRequiredMixin, generic.ListView):
+class RentRequestStaffListView(PermissionRequiredMixin, KeysetPaginationMixin, RelationLoadingMixin,
+                               generic.ListView):
     template_name = 'car_rental/request_list_staff.html'
     model = RentRequest
     context_object_name = 'requests'
     permission_required = 'car_rental.can_answer_request'
+    select_related = ('car', 'requester')
+    only_fields = ('id', 'price', 'rent_start_time', 'rent_end_time', 'car__id', 'car__car_type', 'car__plate',
+                   'car__price_per_hour', 'requester__id', 'requester__username')
+    paginate_by = 20
+    keyset_fields = ('rent_start_time', 'id')
+    keyset_count = 'bounded'
+
+    def get_base_queryset(self):
+        return self.request.actor.exhibition.get_pending_requests()
+
+    def get_context_data(self, **kwargs):
+        # Requests arriving after the page is rendered have a larger id and are fetched by the new requests poll.
+        kwargs['queue_since'] = RentRequest.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        kwargs['poll_seconds'] = getattr(settings, 'REQUEST_QUEUE_POLL_SECONDS', 15)
+        return super(RentRequestStaffListView, self).get_context_data(**kwargs)
 
-    def get_queryset(self):
-        current_user = self.request.user
-        return current_user.staff.exhibition.get_all_requests().order_by('rent_start_time').filter(has_result=False)
+
+@login_required()
+@decorators.user_is_staff
+@permission_required('car_rental.can_answer_request', raise_exception=True)
+def new_requests_staff_view(request):
+    try:
+        since = int(request.GET.get('since', ''))
+    except ValueError:
+        return HttpResponseBadRequest('since must be a request id.')
+    limit = getattr(settings, 'REQUEST_QUEUE_POLL_LIMIT', 50)
+    requests = request.actor.exhibition.get_pending_requests().filter(id__gt=since).order_by('id') \
+        .select_related('car', 'requester').only(*RentRequestStaffListView.only_fields)[:limit]
+    return render(request, 'car_rental/includes/request_rows.html', {'requests': requests, 'new': True})
+
+
+def events_view(request):
+    # The event stream is served by car_site/asgi.py. Without it, 204 tells EventSource not to reconnect and
+    # the pages fall back to polling.
+    return HttpResponse(status=204)
 
 
 @login_required()
 @decorators.user_is_staff
 @permission_required('car_rental.can_answer_request', raise_exception=True)
+@write_transaction
 def answer_requests_view(request):
     user = request.user
     if request.method == 'POST':
-        unanswered_requests = user.staff.exhibition.get_all_requests().filter(has_result=False)
-        for unanswered_request in unanswered_requests:
-            try:
-                answer = request.POST[str(unanswered_request.id)]
-                if answer == 'yes':
-                    if unanswered_request.car.is_rented():
-                        messages.error(request,
-                                       'Car ' + unanswered_request.car.car_type + ' is already rented.')
-                        unanswered_request.reject(user)
-                    else:
-                        unanswered_request.accept(user)
-                elif answer == 'no':
-                    unanswered_request.reject(user)
-                else:
-                    pass
-            except KeyError:
-                pass
-    return HttpResponseRedirect(reverse('car_rental:requests_staff'))
+        answers = {int(key): value for key, value in request.POST.items()
+                   if key.isdigit() and value in ('yes', 'no')}
+        for rejected_request in request.actor.exhibition.get_all_requests().answer(user, answers):
+            messages.error(request, 'Car ' + rejected_request.car.car_type + ' is already rented.')
+    # Answered requests leave the queue, so the same cursor shows the rest of the page that was answered.
+    url = reverse('car_rental:requests_staff')
+    if request.GET:
+        url += '?' + request.GET.urlencode()
+    return HttpResponseRedirect(url)
 
 
 @login_required()
 def profile_view(request):
-    return render(request, 'car_rental/profile.html')
+    answered_requests = []
+    if request.user.is_staff:
+        answered_requests = request.actor.staff.rentrequest_set.select_related('car')
+    return render(request, 'car_rental/profile.html', {'answered_requests': answered_requests})
 
 
 @login_required()
@@ -147,6 +242,7 @@ def change_password(request):
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(write_transaction, name='post')
 class ChangeCreditView(PermissionRequiredMixin, generic.FormView):
     template_name = 'car_rental/change_credit.html'
     form_class = my_forms.ChangeCreditForm
@@ -159,6 +255,42 @@ class ChangeCreditView(PermissionRequiredMixin, generic.FormView):
         return HttpResponseRedirect(reverse('car_rental:profile'))
 
 
+@login_required()
+@permission_required('car_rental.can_access_credit', raise_exception=True)
+def credit_history_view(request):
+    user = request.user
+    account = request.actor.exhibition if user.is_staff else user
+    before = request.GET.get('before', '')
+    page_size = 20
+    transactions = CreditTransaction.objects.history(account, before=int(before) if before.isdigit() else None,
+                                                     limit=page_size)
+    next_cursor = transactions[-1].id if len(transactions) == page_size else None
+    return render(request, 'car_rental/credit_history.html',
+                  {'transactions': transactions, 'next_cursor': next_cursor})
+
+
+@login_required()
+@decorators.user_is_staff
+@permission_required('car_rental.can_access_credit', raise_exception=True)
+def stats_view(request):
+    exhibition = request.actor.exhibition
+    days = request.GET.get('days', '30')
+    days = int(days) if days in ('7', '30', '90', '365') else 30
+    end_day = timezone.localdate()
+    start_day = end_day - datetime.timedelta(days=days - 1)
+    daily_stats = list(exhibition.daily_stats.filter(day__range=(start_day, end_day)).order_by('-day'))
+    totals = {field: sum(getattr(row, field) for row in daily_stats) for field in DailyStats.FIELDS}
+    fleet_size = exhibition.cars_owned.count()
+    utilization = totals['rented_hours'] * 100 / (fleet_size * 24 * days) if fleet_size else 0
+    top_cars = DailyCarStats.objects.filter(car__owner=exhibition, day__range=(start_day, end_day)) \
+        .values('car_id', 'car__car_type', 'car__plate') \
+        .annotate(**{field: Sum(field) for field in DailyStats.FIELDS}).order_by('-revenue', 'car_id')[:10]
+    return render(request, 'car_rental/stats.html', {
+        'days': days, 'day_choices': (7, 30, 90, 365), 'daily_stats': daily_stats, 'totals': totals,
+        'fleet_size': fleet_size, 'utilization': utilization, 'top_cars': top_cars,
+    })
+
+
 def home_view(request):
     return render(request, 'car_rental/home.html')
 
@@ -198,6 +330,7 @@ def signup(request):
 
 @method_decorator(login_required, name='dispatch')
 @method_decorator(decorators.user_is_staff, name='dispatch')
+@method_decorator(write_transaction, name='post')
 class AddCarView(PermissionRequiredMixin, generic.CreateView):
     model = Car
     template_name = 'car_rental/add_car.html'
@@ -205,12 +338,82 @@ class AddCarView(PermissionRequiredMixin, generic.CreateView):
     permission_required = 'car_rental.can_access_car'
 
     def form_valid(self, form):
+        form.instance.owner = self.request.actor.exhibition
         response = super(AddCarView, self).form_valid(form)
-        current_user = User.objects.get(id=self.request.user.id)
-        self.object.set_owner(current_user.staff.exhibition)
+        schedule_derivatives(self.object)
         return response
 
 
+@method_decorator(login_required, name='dispatch')
+@method_decorator(decorators.user_is_staff, name='dispatch')
+class CarImportView(PermissionRequiredMixin, generic.FormView):
+    form_class = my_forms.CarImportForm
+    template_name = 'car_rental/import_cars.html'
+    permission_required = 'car_rental.can_access_car'
+
+    def form_valid(self, form):
+        car_file = form.cleaned_data['file']
+        file_format = 'jsonl' if car_file.name.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+        images = None
+        if form.cleaned_data['images']:
+            try:
+                images = ArchiveImages(form.cleaned_data['images'])
+            except zipfile.BadZipFile:
+                form.add_error('images', 'The images should be a ZIP archive.')
+                return self.form_invalid(form)
+        try:
+            created, report = import_car_file(self.request.actor.exhibition, car_file, file_format, images,
+                                              ErrorReport(limit=20))
+        finally:
+            if images:
+                images.close()
+        for line, error in report.errors:
+            messages.error(self.request, 'Line ' + str(line) + ': ' + error)
+        if report.count > len(report.errors):
+            messages.error(self.request, str(report.count - len(report.errors)) + ' more rows have errors.')
+        messages.success(self.request, str(created) + ' cars imported.')
+        return HttpResponseRedirect(reverse('car_rental:cars_staff'))
+
+
+@login_required()
+@decorators.user_is_staff
+@permission_required('car_rental.can_access_car', raise_exception=True)
+@require_POST
+@write_transaction
+def bulk_car_action_view(request):
+    form = my_forms.CarBulkActionForm(request.POST)
+    success_url = reverse('car_rental:cars_staff') + ('?' + request.GET.urlencode() if request.GET else '')
+    if not form.is_valid():
+        for error in form.errors.values():
+            messages.error(request, ' '.join(error))
+        return HttpResponseRedirect(success_url)
+    action = form.cleaned_data['action']
+    value = form.cleaned_data['value']
+    cars = request.actor.exhibition.cars_owned.all()
+    if form.cleaned_data['select_all']:
+        filterset = my_filters.CarStaffFilterSet(request.GET, queryset=cars)
+        # The search joins its index table, which UPDATE and DELETE cannot carry, so it becomes an id subquery.
+        cars = cars.filter(id__in=filterset.qs.order_by().values('id')) if filterset.is_valid() else cars.none()
+    else:
+        cars = cars.filter(id__in=form.cleaned_data['selection'])
+    if action in ('mark_repair', 'clear_repair'):
+        count = cars.set_needs_repair(action == 'mark_repair')
+    else:
+        # Like EditCarView and DeleteCarView, cars that are rented or booked are left unchanged.
+        cars = cars.without_bookings_after(timezone.now())
+        if action == 'delete':
+            count = cars.delete_fleet()
+        elif action == 'reprice_percent':
+            count = cars.reprice(percent=value)
+        else:
+            count = cars.reprice(amount=value)
+    messages.success(request, str(count) + (' cars deleted.' if action == 'delete' else ' cars updated.'))
+    if not form.cleaned_data['select_all'] and count < len(set(form.cleaned_data['selection'])):
+        messages.error(request, str(len(set(form.cleaned_data['selection'])) - count) +
+                       ' selected cars are rented or booked and were not changed.')
+    return HttpResponseRedirect(success_url)
+
+
 @method_decorator(login_required, name='dispatch')
 @method_decorator(decorators.user_is_staff, name='dispatch')
 class EditCarView(PermissionRequiredMixin, generic.UpdateView):
@@ -220,8 +423,7 @@ class EditCarView(PermissionRequiredMixin, generic.UpdateView):
     permission_required = 'car_rental.can_access_car'
 
     def get_queryset(self):
-        current_user = self.request.user
-        return current_user.staff.exhibition.cars_owned.filter(rent_end_time__lte=timezone.now())
+        return self.request.actor.exhibition.cars_owned.without_bookings_after(timezone.now())
 
 
 @method_decorator(login_required, name='dispatch')
@@ -234,8 +436,7 @@ class DeleteCarView(PermissionRequiredMixin, generic.DeleteView):
         return reverse('car_rental:cars')
 
     def get_queryset(self):
-        current_user = self.request.user
-        return current_user.staff.exhibition.cars_owned.filter(rent_end_time__lte=timezone.now())
+        return self.request.actor.exhibition.cars_owned.without_bookings_after(timezone.now())
 
 
 @method_decorator(login_required, name='dispatch')
@@ -247,14 +448,13 @@ class UserDetailView(PermissionRequiredMixin, generic.DetailView):
 
     def get_queryset(self):
         current_user = self.request.user
-        queryset = User.objects.none()
-        if current_user.is_staff:
-            for rent_request in current_user.staff.exhibition.get_all_requests():
-                queryset |= User.objects.filter(id=rent_request.requester.id)
-        return queryset
+        if current_user.is_staff and self.request.actor.exhibition.has_customer(self.kwargs['pk']):
+            return User.objects.all()
+        return User.objects.none()
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(write_transaction, name='post')
 class NeedRepairCarView(generic.UpdateView):
     model = Car
     template_name = 'car_rental/need_repair.html'
@@ -265,8 +465,8 @@ class NeedRepairCarView(generic.UpdateView):
         car = self.object
         if car.renter == self.request.user:
             if car.needs_repair:
-                car.renter.change_credit(-100)
-                car.owner.change_credit(100)
+                apply_credit_transactions([car.renter.credit_transaction(-100, 'REPAIR'),
+                                           car.owner.credit_transaction(100, 'REPAIR')])
             car.needs_repair = False
             car.save()
         return response
@@ -274,7 +474,7 @@ class NeedRepairCarView(generic.UpdateView):
     def get_queryset(self):
         current_user = self.request.user
         if current_user.is_staff:
-            return current_user.staff.exhibition.cars_owned.all()
+            return self.request.actor.exhibition.cars_owned.all()
         else:
             return current_user.cars_rented.filter(needs_repair=True)
 
@@ -294,9 +494,8 @@ class StaffCreateView(PermissionRequiredMixin, generic.CreateView):
         return User.objects.all()
 
     def form_valid(self, form):
-        current_user = self.request.user
         response = super(StaffCreateView, self).form_valid(form)
-        exhibition = current_user.staff.exhibition
+        exhibition = self.request.actor.exhibition
         is_senior = False
         if form.cleaned_data.get('staff_type') == 'S':
             is_senior = True
@@ -305,30 +504,50 @@ class StaffCreateView(PermissionRequiredMixin, generic.CreateView):
         return response
 
 
+@method_decorator(login_required, name='dispatch')
+@method_decorator(decorators.user_is_senior_staff, name='dispatch')
+class StaffImportView(PermissionRequiredMixin, generic.FormView):
+    form_class = my_forms.StaffImportForm
+    template_name = 'car_rental/import_staff.html'
+    permission_required = 'car_rental.can_access_staff'
+
+    def form_valid(self, form):
+        csv_file = io.TextIOWrapper(form.cleaned_data['file'], encoding='utf-8-sig')
+        created, errors = import_staff(self.request.actor.exhibition, csv.DictReader(csv_file))
+        for line, error in errors[:20]:
+            messages.error(self.request, 'Line ' + str(line) + ': ' + error)
+        messages.success(self.request, str(created) + ' staff imported.')
+        return HttpResponseRedirect(reverse('car_rental:staff'))
+
+
 @method_decorator(login_required, name='dispatch')
 @method_decorator(decorators.user_is_staff, name='dispatch')
-class StaffListView(PermissionRequiredMixin, SingleTableMixin, filter_views.FilterView):
+class StaffListView(PermissionRequiredMixin, KeysetPaginationMixin, RelationLoadingMixin, SingleTableMixin,
+                    filter_views.FilterView):
     model = Staff
     template_name = 'car_rental/staff_list.html'
     context_object_name = 'staff_list'
-    paginate_by = 7
     permission_required = 'car_rental.can_access_staff'
     filterset_class = my_filters.StaffFilterSet
     table_class = my_tables.StaffTable
+    select_related = ('user',)
+    only_fields = ('id', 'exhibition', 'is_senior', 'user__username')
 
-    def get_queryset(self):
-        return self.request.user.staff.exhibition.staff_set.exclude(id=self.request.user.staff.id)
+    def get_base_queryset(self):
+        return self.request.actor.exhibition.staff_set.exclude(id=self.request.actor.staff.id)
 
 
 @method_decorator(login_required, name='dispatch')
 @method_decorator(decorators.user_is_staff, name='dispatch')
-class StaffDetailView(PermissionRequiredMixin, generic.DetailView):
+class StaffDetailView(PermissionRequiredMixin, RelationLoadingMixin, generic.DetailView):
     model = Staff
     template_name = 'car_rental/staff_detail.html'
     permission_required = 'car_rental.can_access_staff'
+    select_related = ('user',)
+    prefetch_related = ('rentrequest_set__car',)
 
-    def get_queryset(self):
-        return self.request.user.staff.exhibition.staff_set.exclude(id=self.request.user.staff.id)
+    def get_base_queryset(self):
+        return self.request.actor.exhibition.staff_set.exclude(id=self.request.actor.staff.id)
 
 
 @method_decorator(login_required, name='dispatch')
@@ -342,7 +561,7 @@ class StaffDeleteView(PermissionRequiredMixin, generic.DeleteView):
         return reverse('car_rental:staff')
 
     def get_queryset(self):
-        staff_queryset = self.request.user.staff.exhibition.staff_set.exclude(id=self.request.user.staff.id)
+        staff_queryset = self.request.actor.exhibition.staff_set.exclude(id=self.request.actor.staff.id)
         user_queryset = User.objects.filter(staff__in=staff_queryset)
         return user_queryset
 
@@ -375,3 +594,10 @@ class ChangePermissions(PermissionRequiredMixin, generic.UpdateView):
         else:
             self.object.remove_permissions('can_access_staff')
         return response
+
+
+@user_passes_test(lambda user: user.is_superuser)
+def query_stats_view(request):
+    if request.method == 'POST':
+        query_stats.reset()
+    return JsonResponse(query_stats.snapshot())
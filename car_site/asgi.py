@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'car_site.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from car_rental.async_views import route_events  # noqa: E402 (needs the apps loaded by get_asgi_application)
+
+application = route_events(django_application)
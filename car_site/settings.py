@@ -50,11 +50,13 @@ INSTALLED_APPS = [
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 MIDDLEWARE = [
+    'car_rental.middleware.QueryStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'car_rental.middleware.ActorMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,6 +76,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media',
+                'car_rental.context_processors.actor',
             ],
         },
     },
@@ -87,11 +90,26 @@ WSGI_APPLICATION = 'car_site.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'car_site.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 5,
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'cache_size': -20000,
+                'mmap_size': 134217728,
+            },
+        },
     }
 }
 
+# Write views run in BEGIN IMMEDIATE transactions and retry "database is locked" errors this many times,
+# sleeping a random time up to WRITE_RETRY_DELAY * 2 ** attempt seconds, capped at WRITE_RETRY_MAX_DELAY.
+WRITE_RETRY_ATTEMPTS = 5
+WRITE_RETRY_DELAY = 0.05
+WRITE_RETRY_MAX_DELAY = 1
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -142,6 +160,73 @@ AUTH_USER_MODEL = 'car_rental.User'
 
 AUTHENTICATION_BACKENDS = ('django.contrib.auth.backends.ModelBackend',)
 
+POPULAR_CAR_REQUEST_COUNT = 3
+
+# Seconds to cache the set of customers of each exhibition, 0 disables the cache.
+EXHIBITION_CUSTOMER_CACHE_TIMEOUT = 0
+
+# Record query count, SQL time and repeated queries of every view, see car_rental:query_stats.
+QUERY_STATS_ENABLED = True
+
+# Processes used to hash passwords of imported staff, None uses every CPU.
+STAFF_IMPORT_WORKERS = None
+
+# Resized WEBP copies of every car image, built by CAR_IMAGE_WORKERS threads after the upload is committed.
+CAR_IMAGE_WIDTHS = (320, 640, 1024)
+CAR_IMAGE_WORKERS = 2
+CAR_IMAGE_DERIVATIVES_ASYNC = True
+
+# Cars inserted per transaction by the fleet import, and the largest image file it attaches.
+CAR_IMPORT_CHUNK_SIZE = 500
+CAR_IMPORT_MAX_IMAGE_SIZE = 10 * 1024 * 1024
+
+# Cars moved per transaction by the sweep_rentals command.
+RENTAL_SWEEP_BATCH_SIZE = 500
+
+# Seconds between checks of the staff request queue for new requests, and the most requests one check returns.
+REQUEST_QUEUE_POLL_SECONDS = 15
+REQUEST_QUEUE_POLL_LIMIT = 50
+
+# Server-sent events of request answers and new requests, streamed by car_site/asgi.py. Every worker only
+# reaches its own streams through LocalTransport; several ASGI workers need a transport shared between them.
+EVENT_TRANSPORT = 'car_rental.events.LocalTransport'
+EVENT_QUEUE_SIZE = 100
+EVENT_STREAM_KEEPALIVE = 15
+
+# Seconds to cache the staff row and permissions of a user. Changes made through the models replace the
+# actor_version on the user row, so every worker reads the new context on its next request.
+ACTOR_CACHE_TIMEOUT = 300
+
+# Seconds to cache the renter catalog per filter, cut short by the next rental start or end. 0 disables it.
+# The availability epoch that drops stale catalogs is kept in the default cache, which is per process with
+# LocMem: run several workers against a shared default cache, or other workers lag behind by up to this long.
+CAR_CATALOG_CACHE_TIMEOUT = 60
+
+# URL names of car_rental served by the async views in car_rental/async_views.py, the rest stay synchronous.
+ASYNC_VIEWS = {'home', 'cars', 'car', 'requests_renter'}
+
+# Rendered car cards and car detail fragments are cached under (car id, Car.updated_at) in the 'fragments'
+# cache. FRAGMENT_CACHE=file keeps them in a file cache shared by every worker process.
+FRAGMENT_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'fragments',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': FRAGMENT_CACHE_BACKENDS[os.environ.get('FRAGMENT_CACHE', 'locmem')],
+}
+
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
 
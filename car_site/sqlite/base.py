@@ -0,0 +1,31 @@
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,
+    'mmap_size': 134217728,
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # SQLite backend tuned for concurrent writers. OPTIONS may set 'pragmas', run on every new connection, and
+    # 'transaction_mode', used to BEGIN transactions. car_rental.transactions.immediate_atomic asks for one
+    # BEGIN IMMEDIATE transaction regardless of the mode.
+    force_immediate = False
+
+    def get_connection_params(self):
+        kwargs = super(DatabaseWrapper, self).get_connection_params()
+        self.pragmas = dict(DEFAULT_PRAGMAS, **kwargs.pop('pragmas', {}))
+        self.transaction_mode = kwargs.pop('transaction_mode', 'DEFERRED').upper()
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        connection = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            connection.execute('PRAGMA %s = %s' % (name, value))
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        mode = 'IMMEDIATE' if self.force_immediate else getattr(self, 'transaction_mode', 'DEFERRED')
+        self.cursor().execute('BEGIN ' + mode)